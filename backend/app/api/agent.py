@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from app.services.mcp_client import mcp_client
-from app.services.agent_runner import run_agent_chat
+from app.services.agent_runner import run_agent_chat, run_agent_events
+from app.core.sse import format_sse, sse_response
 
 router = APIRouter()
 
@@ -21,6 +22,11 @@ async def get_tools():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/tools/stats")
+async def get_tool_stats():
+    """MCPセッションプールの状態 (接続数・実行中の呼び出し数・再起動回数など) を返す"""
+    return mcp_client.stats()
+
 @router.post("/tools/call")
 async def call_tool(request: ToolCallRequest):
     """指定されたMCPツールを実行する"""
@@ -40,4 +46,18 @@ async def chat_with_agent(request: AgentChatRequest):
         import traceback
         error_trace = traceback.format_exc()
         print(f"❌ [ERROR] Agent chat failed:\n{error_trace}")
-        raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
+
+@router.post("/chat/stream")
+async def chat_with_agent_stream(request: AgentChatRequest):
+    """
+    /chat のストリーミング版 (Server-Sent Events)
+
+    生成されたテキスト (token) とツールの実行状況 (tool_call / tool_result) を届いた順に送り、
+    最後に最終回答 (done) を送る。
+    """
+    async def frames():
+        async for event, data in run_agent_events(request.message):
+            yield format_sse(event, data)
+
+    return sse_response(frames())
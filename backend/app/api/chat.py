@@ -1,8 +1,12 @@
 from fastapi import APIRouter, HTTPException
 from app.schemas.chat import ChatRequest, ChatResponse
 from app.services.search import search_relevant_documents
-from app.services.generation import generate_answer
+from app.services.context import assemble_context
+from app.services.generation import generate_answer, generate_answer_stream, is_error_answer
+from app.services.answer_cache import answer_cache, embed_question, current_version, source_ids
+from app.core.sse import format_sse, sse_response
 import logging
+import time
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -13,30 +17,103 @@ async def chat_with_docs(request: ChatRequest):
     RAG完全版: 検索(Retrieve) -> 生成(Generate)
     """
     try:
+        started = time.perf_counter()
+        version = current_version()
+        question_vector = await embed_question(request.message)
+
         # 1. Retrieve: 質問に関連するドキュメントを検索 (Top 5)
         logger.info(f"Searching documents for query: {request.message[:100]}")
         search_results = await search_relevant_documents(query=request.message, limit=5)
+
+        # 回答キャッシュ確認 (言い換えを含め、同じ資料に基づく同じ質問への最近の回答があればそれを返す)
+        documents = source_ids(search_results)
+        if question_vector is not None:
+            hit = answer_cache.lookup("rag", request.message, question_vector, documents)
+            if hit is not None:
+                return ChatResponse(**hit[0])
         
         if not search_results:
             logger.warning("No documents found for query")
             # 検索結果がない場合でも回答は試みる
         
-        # 検索結果からテキスト部分だけをリストにする
-        context_texts = [item.text for item in search_results]
+        # 検索結果を参考情報にまとめる (隣接チャンクの結合・重複の除去・トークン数の上限)
+        context_texts = await assemble_context(search_results)
         
         # 2. Generate: 検索結果をコンテキストとしてLLMに渡す
         logger.info(f"Generating answer with {len(context_texts)} context documents")
         answer = await generate_answer(query=request.message, context_texts=context_texts)
         
         # 3. Response: 回答と、根拠となったソースを返す
-        return ChatResponse(
+        response = ChatResponse(
             reply=answer,
             sources=search_results
         )
+        if question_vector is not None and search_results and not is_error_answer(answer):
+            answer_cache.store(
+                "rag", request.message, question_vector, version, documents,
+                response.model_dump(), time.perf_counter() - started
+            )
+        return response
     
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"チャット処理中にエラーが発生しました: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.post("/chat/stream")
+async def chat_with_docs_stream(request: ChatRequest):
+    """
+    /chat のストリーミング版 (Server-Sent Events)
+
+    イベント:
+        sources: 検索結果 (最初のフレーム。検索が終わった時点で送る)
+        token: 生成されたテキストの断片 ({"text": ...})
+        done: 生成完了 ({"reply": 回答全体})
+        error: 処理中のエラー ({"message": ...})
+    """
+    async def frames():
+        try:
+            started = time.perf_counter()
+            version = current_version()
+            question_vector = await embed_question(request.message)
+
+            logger.info(f"Searching documents for query: {request.message[:100]}")
+            search_results = await search_relevant_documents(query=request.message, limit=5)
+            documents = source_ids(search_results)
+            hit = None
+            if question_vector is not None:
+                hit = answer_cache.lookup("rag", request.message, question_vector, documents)
+            if hit is not None:
+                # キャッシュした回答は1フレームでまとめて送る
+                cached = hit[0]
+                yield format_sse("sources", cached["sources"])
+                yield format_sse("token", {"text": cached["reply"]})
+                yield format_sse("done", {"reply": cached["reply"], "cached": True})
+                return
+
+            yield format_sse("sources", [item.model_dump() for item in search_results])
+
+            context_texts = await assemble_context(search_results)
+            logger.info(f"Streaming answer with {len(context_texts)} context documents")
+            reply = []
+            async for text in generate_answer_stream(query=request.message, context_texts=context_texts):
+                reply.append(text)
+                yield format_sse("token", {"text": text})
+            answer = "".join(reply)
+            yield format_sse("done", {"reply": answer})
+
+            if question_vector is not None and search_results and answer and not is_error_answer(answer):
+                answer_cache.store(
+                    "rag", request.message, question_vector, version, documents,
+                    {"reply": answer, "sources": [item.model_dump() for item in search_results]},
+                    time.perf_counter() - started
+                )
+
+        except Exception as e:
+            # ヘッダー送信後なので HTTP エラーにはできない。エラーイベントとして通知する
+            logger.error(f"Error in chat stream endpoint: {e}", exc_info=True)
+            yield format_sse("error", {"message": f"チャット処理中にエラーが発生しました: {str(e)}"})
+
+    return sse_response(frames())
@@ -1,14 +1,38 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, status, BackgroundTasks
-from app.schemas.document import UploadResponse
-from app.services.extractor import extract_text_from_pdf
-from app.services.ingestion import process_and_save_document
+import asyncio
+import os
+import uuid
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status
+from app.core.config import settings
+from app.schemas.document import (
+    UploadResponse,
+    JobStatusResponse,
+    BulkFileResult,
+    BulkUploadResponse,
+)
+from app.services.extractor import spool_upload, spool_zip_members
+from app.services.jobs import get_job_queue
 
 router = APIRouter()
 
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+
+
+def _is_zip(file: UploadFile) -> bool:
+    return file.content_type in ZIP_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip")
+
+
+def _parse_tags(tags: str | None) -> list[str]:
+    """
+    カンマ区切りのタグを、空要素と重複を除いたリストにする
+    """
+    if not tags:
+        return []
+    return list(dict.fromkeys(tag.strip() for tag in tags.split(",") if tag.strip()))
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_document(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    tags: str | None = Form(None, description="検索の絞り込みに使うタグ (カンマ区切り)")
 ):
     # PDF以外は拒否
     if file.content_type != "application/pdf":
@@ -17,27 +41,136 @@ async def upload_document(
             detail="Only PDF files are allowed."
         )
 
-    # テキスト抽出ロジックの呼び出し
-    text_content = await extract_text_from_pdf(file)
+    # アップロードを一時ファイルに書き出す (全体をメモリに載せない)
+    path = await spool_upload(file)
 
-    if not text_content:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Failed to extract text from PDF."
-        )
-
-    # RAGパイプラインへの投入 (バックグラウンド処理)
-    # ユーザーにはすぐにレスポンスを返しつつ、裏でベクトル化・保存を行う
-    background_tasks.add_task(
-        process_and_save_document, 
-        filename=file.filename, 
-        text=text_content
-    )
+    # RAGパイプラインへの投入 (永続キュー経由)
+    # ファイルを受け付けた時点でレスポンスを返し、抽出・ベクトル化・保存はワーカーが順に処理する
+    job = await get_job_queue().enqueue(filename=file.filename, path=path, tags=_parse_tags(tags))
 
     # レスポンス返却
     return UploadResponse(
+        job_id=job["id"],
         filename=file.filename,
         content_type=file.content_type,
-        extracted_text_preview=text_content[:100] + "...",
-        message="Successfully uploaded. Processing for search in background." # メッセージを少し変更
-    )
\ No newline at end of file
+        message="Successfully uploaded. Processing for search in background."
+    )
+
+@router.get("/documents/{job_id}", response_model=JobStatusResponse)
+async def get_document_job(job_id: str):
+    """
+    取り込みジョブの状態と進捗を返す
+    """
+    job = await get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found."
+        )
+    return JobStatusResponse(job_id=job["id"], **{k: v for k, v in job.items() if k not in ("id", "path")})
+
+
+@router.post("/documents/bulk", response_model=BulkUploadResponse)
+async def upload_documents_bulk(
+    files: list[UploadFile] = File(...),
+    tags: str | None = Form(None, description="すべてのファイルに付けるタグ (カンマ区切り)")
+):
+    """
+    複数のPDF、またはPDFを含むZIPアーカイブをまとめて受け付ける。
+    各ファイルは個別の取り込みジョブとして登録され、ワーカーが並行して処理する
+    (埋め込みのバッチはドキュメントをまたいで共有される)。
+    """
+    queue = get_job_queue()
+    batch_id = str(uuid.uuid4())
+    tag_list = _parse_tags(tags)
+    results: list[BulkFileResult] = []
+    accepted = 0
+    extracted_bytes = 0  # ZIPから展開したファイルの合計サイズ (BULK_MAX_TOTAL_BYTES まで)
+    # ドキュメントIDはファイル名から決まるため、同じ名前のファイルが2つあると後のジョブが前のものを上書きしてしまう
+    seen_names: set[str] = set()
+
+    async def enqueue(filename: str, path: str):
+        nonlocal accepted
+        if accepted >= settings.BULK_MAX_FILES:
+            os.remove(path)
+            results.append(BulkFileResult(filename=filename, status="rejected", error="Too many files in one request."))
+            return
+        if filename in seen_names:
+            os.remove(path)
+            results.append(BulkFileResult(filename=filename, status="rejected", error="Duplicate file name in one request."))
+            return
+        seen_names.add(filename)
+        job = await queue.enqueue(filename=filename, path=path, batch_id=batch_id, tags=tag_list)
+        results.append(BulkFileResult(filename=filename, job_id=job["id"], status=job["status"]))
+        accepted += 1
+
+    for file in files:
+        if _is_zip(file):
+            # ZIPは一時ファイルに書き出してから、中のPDFを1つずつ展開する
+            zip_path = await spool_upload(file, suffix=".zip")
+            try:
+                members = await asyncio.to_thread(
+                    spool_zip_members, zip_path, settings.BULK_MAX_FILES - accepted,
+                    settings.BULK_MAX_TOTAL_BYTES - extracted_bytes
+                )
+            except Exception as e:
+                results.append(BulkFileResult(filename=file.filename, status="rejected", error=f"Invalid archive: {e}"))
+                continue
+            finally:
+                os.remove(zip_path)
+
+            extracted_bytes += sum(os.path.getsize(path) for _, path, _ in members if path is not None)
+            for name, path, error in members:
+                if path is None:
+                    results.append(BulkFileResult(filename=name, status="rejected", error=error))
+                else:
+                    await enqueue(name, path)
+
+        elif file.content_type == "application/pdf":
+            await enqueue(file.filename, await spool_upload(file))
+
+        else:
+            results.append(BulkFileResult(filename=file.filename, status="rejected", error="Only PDF or ZIP files are allowed."))
+
+    # 受け付けなかったファイルも、バッチの状態確認 (GET) で返せるよう記録しておく
+    await queue.add_rejections(
+        batch_id, [(result.filename, result.error) for result in results if result.status == "rejected"]
+    )
+
+    return BulkUploadResponse(
+        batch_id=batch_id,
+        accepted=accepted,
+        rejected=len(results) - accepted,
+        files=results
+    )
+
+@router.get("/documents/batches/{batch_id}", response_model=BulkUploadResponse)
+async def get_document_batch(batch_id: str):
+    """
+    一括取り込みに含まれる各ファイルのジョブ状態を返す
+    """
+    queue = get_job_queue()
+    jobs = await queue.list_batch(batch_id)
+    rejections = await queue.list_rejections(batch_id)
+    if not jobs and not rejections:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Batch not found."
+        )
+    files = [
+        BulkFileResult(
+            filename=job["filename"],
+            job_id=job["id"],
+            status=job["status"],
+            pages=job["pages"],
+            chunks_embedded=job["chunks_embedded"],
+            points_upserted=job["points_upserted"],
+            error=job["error"],
+        )
+        for job in jobs
+    ]
+    files += [
+        BulkFileResult(filename=rejection["filename"], status="rejected", error=rejection["error"])
+        for rejection in rejections
+    ]
+    return BulkUploadResponse(batch_id=batch_id, accepted=len(jobs), rejected=len(rejections), files=files)
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Response
+from app.core.metrics import CONTENT_TYPE, REGISTRY, callback_gauge
+from app.services.answer_cache import answer_cache
+from app.services.embeddings import get_embedding_engine
+from app.services.mcp_client import mcp_client
+from app.services.search import query_cache
+
+router = APIRouter()
+
+
+def _cache_stats() -> dict[str, dict]:
+    embedding_cache = get_embedding_engine().cache
+    stats = {
+        "query": query_cache.stats(),
+        "answer": answer_cache.stats(),
+    }
+    if embedding_cache:
+        stats["embedding"] = embedding_cache.stats()
+    return stats
+
+
+def _cache_values(field: str) -> dict[tuple, float]:
+    return {(name, ): stats[field] for name, stats in _cache_stats().items()}
+
+
+def _mcp_values(field: str) -> dict[tuple, float]:
+    return {(): mcp_client.stats()[field]}
+
+
+# キャッシュとMCPプールの状態は、スクレイプのたびに各モジュールの stats() から読む
+callback_gauge("docubrain_cache_entries", "Number of entries in each cache.", lambda: _cache_values("entries"), ("cache",))
+callback_gauge("docubrain_cache_hits", "Cache hits since startup.", lambda: _cache_values("hits"), ("cache",))
+callback_gauge("docubrain_cache_misses", "Cache misses since startup.", lambda: _cache_values("misses"), ("cache",))
+callback_gauge("docubrain_cache_hit_ratio", "Cache hit ratio since startup.", lambda: _cache_values("hit_rate"), ("cache",))
+callback_gauge("docubrain_mcp_pool_size", "Configured number of MCP sessions.", lambda: _mcp_values("pool_size"))
+callback_gauge("docubrain_mcp_healthy_sessions", "Number of connected MCP sessions.", lambda: _mcp_values("healthy"))
+callback_gauge("docubrain_mcp_in_flight", "MCP calls currently in flight.", lambda: _mcp_values("in_flight"))
+callback_gauge("docubrain_mcp_restarts", "MCP session restarts since startup.", lambda: _mcp_values("restarts"))
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus 形式のメトリクス (各段階の所要時間・HTTPリクエスト・キャッシュ・MCPプール)
+    """
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException
-from app.schemas.search import SearchRequest, SearchResponse
-from app.services.search import search_relevant_documents
+from fastapi import APIRouter, HTTPException, status
+from app.core.config import settings
+from app.schemas.search import SearchRequest, SearchResponse, BatchSearchRequest, BatchSearchResponse
+from app.services.search import search_relevant_documents, search_relevant_documents_batch, query_cache
+from app.services.embeddings import get_embedding_engine
+from app.services.answer_cache import answer_cache
 
 router = APIRouter()
 
@@ -12,10 +15,44 @@ async def search_documents(request: SearchRequest):
     try:
         results = await search_relevant_documents(
             query=request.query, 
-            limit=request.limit
+            limit=request.limit,
+            filters=request.filters,
+            hnsw_ef=request.hnsw_ef,
+            exact=request.exact
         )
         return SearchResponse(results=results)
         
     except Exception as e:
         print(f"Search failed: {e}")
-        raise HTTPException(status_code=500, detail="Search processing failed")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Search processing failed")
+
+@router.post("/search/batch", response_model=BatchSearchResponse)
+async def search_documents_batch(request: BatchSearchRequest):
+    """
+    複数の質問をまとめて検索する。埋め込みとQdrantの検索をそれぞれ1回にまとめて実行し、
+    結果をリクエストと同じ順序で返す。
+    """
+    if len(request.queries) > settings.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many queries in one request (max {settings.SEARCH_BATCH_MAX_QUERIES})."
+        )
+    try:
+        results = await search_relevant_documents_batch(request.queries)
+        return BatchSearchResponse(results=[SearchResponse(results=items) for items in results])
+
+    except Exception as e:
+        print(f"Batch search failed: {e}")
+        raise HTTPException(status_code=500, detail="Search processing failed")
+
+@router.get("/search/stats")
+async def search_cache_stats():
+    """
+    検索結果キャッシュ・埋め込みキャッシュ・回答キャッシュのヒット率などを返す
+    """
+    embedding_cache = get_embedding_engine().cache
+    return {
+        "query_cache": query_cache.stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "answer_cache": answer_cache.stats(),
+    }
@@ -8,9 +8,101 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str | None = None
 
     # Qdrant Settings
+    # ":memory:" を指定するとプロセス内のローカルモードで動作する (ベンチマーク用)
     QDRANT_HOST: str 
     QDRANT_PORT: int = 6333
     QDRANT_API_KEY: str | None = None
+    # コレクションの保存形式 (default / scalar / binary / large)。新規作成時にのみ適用される
+    QDRANT_COLLECTION_PROFILE: str = "default"
+    QDRANT_HNSW_EF: int | None = None  # 検索時の HNSW ef (未指定なら Qdrant の既定値)
+    QDRANT_EXACT_SEARCH: bool = False  # True にすると HNSW を使わず全件比較する
+    UPSERT_BATCH_SIZE: int = 64  # 1回の upsert で送るポイント数
+    UPSERT_MAX_IN_FLIGHT: int = 2  # 同時に送信中にできる upsert リクエスト数
+    UPSERT_MAX_RETRIES: int = 3  # 失敗したバッチを再送する回数
+
+    # Embedding Settings
+    # "gemini": Gemini API / "local": ローカルCPUモデル / "fake": オフラインベンチマーク用の決定的なダミーベクトル
+    # "package.module:ClassName" 形式で独自のバックエンドも指定できる
+    EMBEDDING_BACKEND: str = "gemini"
+    EMBEDDING_MODEL: str = "models/text-embedding-004"
+    EMBEDDING_DIMENSION: int = 768  # gemini / fake の次元数 (local はモデルから自動で決まる)
+    LOCAL_EMBEDDING_MODEL: str = "intfloat/multilingual-e5-small"
+    LOCAL_EMBEDDING_BATCH_SIZE: int = 32  # ローカルモデルの1回の推論にまとめるテキスト数
+    LOCAL_EMBEDDING_QUERY_PREFIX: str = "query: "
+    LOCAL_EMBEDDING_DOCUMENT_PREFIX: str = "passage: "
+    EMBEDDING_BATCH_SIZE: int = 100  # 1リクエストにまとめるテキスト数 (Gemini の上限は 100)
+    EMBEDDING_MAX_CONCURRENCY: int = 4  # 同時に投げるバッチリクエスト数
+    EMBEDDING_BATCH_LINGER: float = 0.005  # 端数のバッチを他の呼び出しと相乗りさせるため待つ時間 (秒)
+    EMBEDDING_EXECUTOR_WORKERS: int = 8  # 同期APIを実行する専用スレッドプールのワーカー数
+    EMBEDDING_MAX_RETRIES: int = 5
+    EMBEDDING_RETRY_BASE_DELAY: float = 1.0  # 指数バックオフの初期待ち時間 (秒)
+    EMBEDDING_FAKE_LATENCY: float = 0.0  # fake バックエンドの1バッチあたりの擬似レイテンシ (秒)
+    EMBEDDING_CACHE_SIZE: int = 10000  # メモリ上のLRUキャッシュに保持するベクトル数 (0で無効)
+    EMBEDDING_CACHE_PATH: str | None = None  # 指定するとSQLiteの永続キャッシュを併用する
+
+    # Upload / Extraction Settings
+    # アップロードの一時保存先。ジョブを再起動後に再開できるよう永続ディレクトリを使う
+    UPLOAD_SPOOL_DIR: str | None = "data/uploads"
+    PDF_EXTRACT_WORKERS: int = 2  # PDF抽出用プロセスプールのワーカー数
+    PDF_PAGES_PER_TASK: int = 8  # 1タスクで抽出するページ数
+    BULK_MAX_FILES: int = 5000  # 一括アップロード1回あたりの最大ファイル数 (ZIP内のファイルを含む)
+    BULK_MAX_MEMBER_BYTES: int = 200 * 1024 * 1024  # ZIP内の1ファイルあたりの最大展開サイズ
+    BULK_MAX_TOTAL_BYTES: int = 2 * 1024 * 1024 * 1024  # 一括アップロード1回あたりのZIPの最大展開サイズ (合計)
+    BULK_MAX_COMPRESSION_RATIO: float = 100.0  # ZIP内のファイルの最大圧縮率 (展開サイズ / 圧縮サイズ)
+
+    # Search Settings
+    HYBRID_SEARCH_ENABLED: bool = True  # 密ベクトル + BM25 疎ベクトルのハイブリッド検索
+    HYBRID_PREFETCH_LIMIT: int = 50  # RRF で統合する前に各検索から取得する候補数
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+    BM25_AVG_DOC_TOKENS: float = 256.0  # 文書長の正規化に使う平均トークン数
+    SEARCH_CACHE_SIZE: int = 1024  # 検索結果キャッシュの最大件数 (0で無効)
+    SEARCH_CACHE_TTL: float = 300.0  # 検索結果キャッシュの有効期間 (秒)
+    SEARCH_BATCH_MAX_QUERIES: int = 64  # 一括検索1リクエストあたりの最大クエリ数
+
+    # Rerank Settings (sentence-transformers を別途インストールした場合のみ有効)
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "hotchpotch/japanese-reranker-cross-encoder-xsmall-v1"
+    RERANK_CANDIDATES: int = 20  # 再ランキングのために多めに取得する候補数
+    RERANK_BATCH_SIZE: int = 16
+    RERANK_TIMEOUT: float = 0.5  # この時間内に終わらなければ元の順位を使う (秒)
+
+    # Chunking Settings
+    CHUNK_MAX_TOKENS: int = 400  # 1チャンクの最大トークン数 (概算)
+    CHUNK_OVERLAP_TOKENS: int = 40  # 隣り合うチャンクで重複させる最大トークン数
+
+    # Ingestion Job Settings
+    STATE_DB_PATH: str = "data/docubrain.sqlite3"  # ジョブキューなどのローカル状態を保存するSQLite
+    INGESTION_WORKERS: int = 2  # 同時に処理するドキュメント数
+    JOB_POLL_INTERVAL: float = 5.0  # 新規ジョブの通知がない場合にキューを確認する間隔 (秒)
+
+    # Agent Settings
+    AGENT_TOOL_TIMEOUT: float = 30.0  # ツール1回の実行の制限時間 (秒)。超えた場合はエラーとしてGeminiに返す
+
+    # MCP Settings
+    MCP_SERVER_PATH: str = "/app/app/mcp/server.py"  # Dockerコンテナ内の絶対パス
+    MCP_POOL_SIZE: int = 2  # 起動するMCPサーバープロセス (セッション) の数
+    MCP_CALL_TIMEOUT: float = 10.0  # ツール呼び出し1回の制限時間 (秒)
+    MCP_CONNECT_TIMEOUT: float = 15.0  # 起動時にセッションの接続を待つ時間 (秒)
+    MCP_HEALTH_INTERVAL: float = 15.0  # ping による死活監視の間隔 (秒)
+    MCP_RESPAWN_DELAY: float = 1.0  # プロセスが落ちた後、再起動するまでの待ち時間 (秒)。失敗が続くと倍々に延ばす
+    MCP_TOOL_CACHE_SIZE: int = 1024  # 純粋なツール (readOnly かつ idempotent) の結果キャッシュの最大件数 (0で無効)
+    # サブプロセスを経由せず、このプロセス内で直接実行する信頼済みのツール (純粋なもののみ。app/mcp/server.py と同梱の場合)
+    MCP_INPROCESS_TOOLS: list[str] = ["add", "multiply"]
+
+    # Answer Cache Settings (言い換えを含む同じ質問に、過去の回答を返す)
+    ANSWER_CACHE_SIZE: int = 512  # 保持する回答の最大件数 (0で無効)
+    ANSWER_CACHE_TTL: float = 3600.0  # 回答の有効期間 (秒)
+    ANSWER_CACHE_THRESHOLD: float = 0.95  # 同じ質問とみなす質問ベクトルのコサイン類似度の下限
+
+    # Context Packing Settings (検索結果からプロンプトの参考情報を組み立てる)
+    CONTEXT_MAX_TOKENS: int = 2000  # 参考情報に入れる最大トークン数 (概算)
+    CONTEXT_NEIGHBOR_CHUNKS: int = 0  # 上位のヒットの前後から追加で取得するチャンク数 (0で取得しない)
+    CONTEXT_NEIGHBOR_HITS: int = 3  # 前後のチャンクを取得する対象にする上位のヒット数
+
+    # Tracing / Metrics Settings
+    TRACE_HEADER: str = "X-Trace-Id"  # トレースIDを受け取り・返すヘッダー (無ければ新しく発行する)
+    TRACE_SLOW_REQUEST_SECONDS: float = 2.0  # これより遅いリクエストは段階ごとの内訳をログに出す (0で常に出す)
 
     model_config = SettingsConfigDict(
         env_file=".env",
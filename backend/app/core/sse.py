@@ -0,0 +1,22 @@
+import json
+from collections.abc import AsyncIterator
+from fastapi.responses import StreamingResponse
+
+
+def format_sse(event: str, data) -> str:
+    """
+    Server-Sent Events の1フレームを組み立てる (data は JSON にする)
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(frames: AsyncIterator[str]) -> StreamingResponse:
+    """
+    SSE フレームの非同期ジェネレータをストリーミングレスポンスにする。
+    リバースプロキシ (nginx 等) にバッファリングさせないヘッダーを付ける。
+    """
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,97 @@
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from app.core.metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+# パイプラインの各段階 (抽出・チャンク分割・埋め込み・保存・検索・生成・エージェントの各反復・ツール呼び出し) の所要時間
+STAGE_SECONDS = histogram(
+    "docubrain_stage_duration_seconds",
+    "Duration of each pipeline stage in seconds.",
+    ("stage",),
+)
+STAGE_ERRORS = counter(
+    "docubrain_stage_errors_total",
+    "Number of pipeline stages that raised an exception.",
+    ("stage",),
+)
+
+
+@dataclass
+class Trace:
+    """
+    1リクエスト分のトレース。リクエスト中に実行された段階ごとの所要時間を集める。
+    """
+    trace_id: str
+    spans: list[tuple[str, float]] = field(default_factory=list)  # (段階, 秒)
+
+    def summary(self) -> dict[str, float]:
+        """
+        段階ごとの合計時間 (並行して実行された段階は重複して数える)
+        """
+        totals: dict[str, float] = {}
+        for stage, seconds in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+
+def format_summary(trace: Trace) -> str:
+    """
+    段階ごとの合計時間をログ向けの1行にする (時間の長い順)
+    """
+    totals = sorted(trace.summary().items(), key=lambda item: item[1], reverse=True)
+    return ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in totals)
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar("docubrain_trace", default=None)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def start_trace(trace_id: str | None = None) -> Trace:
+    """
+    現在のコンテキスト (リクエスト) でトレースを開始する。
+    asyncio のタスクやスレッド (to_thread) にはコンテキストごと引き継がれる。
+    """
+    trace = Trace(trace_id or new_trace_id())
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def record(stage: str, seconds: float):
+    """
+    計測済みの所要時間を、ヒストグラムと現在のトレースに記録する
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """
+    処理の所要時間を計測し、ヒストグラムと現在のトレースに記録する。
+
+    例:
+        with span("qdrant_query"):
+            response = await client.query_points(...)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record(stage, time.perf_counter() - started)
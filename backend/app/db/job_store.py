@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from app.core.config import settings
+
+# ジョブの状態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+PROGRESS_FIELDS = ("pages", "chunks_embedded", "points_upserted")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _to_job(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    job["tags"] = json.loads(job["tags"]) if job.get("tags") else []
+    return job
+
+
+class JobStore:
+    """
+    取り込みジョブを SQLite に永続化するストア。
+    プロセスが再起動しても、待機中・実行中だったジョブを再開できる。
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                pages INTEGER NOT NULL DEFAULT 0,
+                chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                points_upserted INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                batch_id TEXT,
+                tags TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        # 既存のDBに後から追加した列を補う
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(ingestion_jobs)")}
+        if "batch_id" not in columns:
+            self._conn.execute("ALTER TABLE ingestion_jobs ADD COLUMN batch_id TEXT")
+        if "tags" not in columns:
+            self._conn.execute("ALTER TABLE ingestion_jobs ADD COLUMN tags TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status, created_at)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_batch ON ingestion_jobs (batch_id)"
+        )
+        # 一括取り込みで受け付けなかったファイル (ジョブは作らないが、バッチの状態確認で返す)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS batch_rejections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                error TEXT,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_batch_rejections_batch ON batch_rejections (batch_id)"
+        )
+        self._conn.commit()
+
+    def create(
+        self, filename: str, path: str, batch_id: str | None = None, tags: list[str] | None = None
+    ) -> dict:
+        job_id = str(uuid.uuid4())
+        now = _now()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ingestion_jobs (id, filename, path, status, batch_id, tags, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, path, JOB_QUEUED, batch_id, json.dumps(tags or [], ensure_ascii=False), now, now),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()
+        return _to_job(row) if row else None
+
+    def list_batch(self, batch_id: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE batch_id = ? ORDER BY created_at", (batch_id,)
+            ).fetchall()
+        return [_to_job(row) for row in rows]
+
+    def add_rejections(self, batch_id: str, rejections: list[tuple[str, str | None]]):
+        """
+        一括取り込みで受け付けなかったファイルの (ファイル名, エラー) を記録する
+        """
+        now = _now()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO batch_rejections (batch_id, filename, error, created_at) VALUES (?, ?, ?, ?)",
+                [(batch_id, filename, error, now) for filename, error in rejections],
+            )
+            self._conn.commit()
+
+    def list_rejections(self, batch_id: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename, error FROM batch_rejections WHERE batch_id = ? ORDER BY id", (batch_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim_next(self) -> dict | None:
+        """
+        最も古い待機中ジョブを実行中にして返す。なければ None。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE ingestion_jobs SET status = ?, updated_at = ? WHERE id = ?",
+                (JOB_RUNNING, _now(), row["id"]),
+            )
+            self._conn.commit()
+        job = _to_job(row)
+        job["status"] = JOB_RUNNING
+        return job
+
+    def update_progress(self, job_id: str, **progress: int):
+        columns = [field for field in PROGRESS_FIELDS if field in progress]
+        if not columns:
+            return
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE ingestion_jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                (*(progress[column] for column in columns), _now(), job_id),
+            )
+            self._conn.commit()
+
+    def finish(self, job_id: str, status: str, error: str | None = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingestion_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, _now(), job_id),
+            )
+            self._conn.commit()
+
+    def requeue_running(self) -> int:
+        """
+        前回のプロセス終了時に実行中だったジョブを待機中に戻す
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ingestion_jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (JOB_QUEUED, _now(), JOB_RUNNING),
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# グローバル変数
+_store = None
+
+def get_job_store() -> JobStore:
+    """
+    ジョブストアを返す (Singleton)
+    """
+    global _store
+    if _store is None:
+        _store = JobStore(settings.STATE_DB_PATH)
+    return _store
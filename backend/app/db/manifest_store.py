@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from app.core.config import settings
+
+
+class ManifestStore:
+    """
+    ドキュメントごとに、Qdrantに保存済みのポイントID一覧 (マニフェスト) を記録するストア。
+    再取り込み時に、変更のないチャンクの再計算を省き、消えたチャンクを削除するために使う。
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS document_manifests (
+                document_id TEXT NOT NULL,
+                point_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (document_id, point_id)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_point_ids(self, document_id: str) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT point_id FROM document_manifests WHERE document_id = ?", (document_id,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def replace(self, document_id: str, filename: str, point_ids: list[str]):
+        """
+        ドキュメントのマニフェストを丸ごと置き換える (point_ids の順序が chunk_index になる)
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM document_manifests WHERE document_id = ?", (document_id,))
+                self._conn.executemany(
+                    "INSERT INTO document_manifests (document_id, point_id, filename, chunk_index, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(document_id, point_id, filename, i, now) for i, point_id in enumerate(point_ids)],
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# グローバル変数
+_store = None
+
+def get_manifest_store() -> ManifestStore:
+    """
+    マニフェストストアを返す (Singleton)
+    """
+    global _store
+    if _store is None:
+        _store = ManifestStore(settings.STATE_DB_PATH)
+    return _store
@@ -1,15 +1,144 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
 import qdrant_client
 from qdrant_client import AsyncQdrantClient, models # 変更
 from app.core.config import settings
+from app.core.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 名前付きベクトル (ハイブリッド検索用のコレクション構成)
+DENSE_VECTOR_NAME = "dense"
+SPARSE_VECTOR_NAME = "bm25"
+
+# フィルタ検索に使うペイロードのインデックス (フィールド名 -> 型)
+# インデックスがないとフィルタ条件の評価が全件走査になるため、コレクション作成時に用意する
+PAYLOAD_INDEXES = {
+    "filename": models.PayloadSchemaType.KEYWORD,
+    "document_id": models.PayloadSchemaType.KEYWORD,
+    "tags": models.PayloadSchemaType.KEYWORD,
+    "uploaded_at": models.PayloadSchemaType.DATETIME,
+    "chunk_index": models.PayloadSchemaType.INTEGER,  # 前後のチャンクの取得 (context.expand_neighbors) 用
+}
+
+
+@dataclass(frozen=True)
+class CollectionProfile:
+    """
+    コレクションの保存形式とHNSWの設定をまとめたプロファイル
+    """
+    quantization: str | None = None  # None / "scalar" (int8) / "binary"
+    on_disk: bool = False  # 元の float32 ベクトルをディスクに置く (量子化ベクトルはRAMに保持)
+    hnsw_m: int | None = None
+    hnsw_ef_construct: int | None = None
+    hnsw_on_disk: bool = False
+    rescore: bool = True  # 量子化ベクトルで候補を絞った後、元のベクトルで再スコアリングする
+    oversampling: float = 2.0  # 再スコアリング用に limit の何倍の候補を取るか
+
+
+COLLECTION_PROFILES = {
+    # float32 をすべてRAMに置く (小規模向け・最も正確)
+    "default": CollectionProfile(),
+    # int8 スカラー量子化: メモリ約1/4、再スコアリングで精度を補う
+    "scalar": CollectionProfile(quantization="scalar", on_disk=True, hnsw_m=16, hnsw_ef_construct=128),
+    # バイナリ量子化: メモリ約1/32、高次元 (768次元以上) のモデル向け。多めにオーバーサンプリングする
+    "binary": CollectionProfile(quantization="binary", on_disk=True, hnsw_m=16, hnsw_ef_construct=128, oversampling=3.0),
+    # 数百万チャンク規模: スカラー量子化に加えてHNSWグラフもディスクに置く
+    "large": CollectionProfile(quantization="scalar", on_disk=True, hnsw_m=32, hnsw_ef_construct=256, hnsw_on_disk=True),
+}
+
+
+def get_collection_profile(name: str | None = None) -> CollectionProfile:
+    name = name or settings.QDRANT_COLLECTION_PROFILE
+    if name not in COLLECTION_PROFILES:
+        raise ValueError(f"Unknown collection profile: {name} (choose from {', '.join(COLLECTION_PROFILES)})")
+    return COLLECTION_PROFILES[name]
+
+
+def _quantization_config(profile: CollectionProfile):
+    if profile.quantization == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if profile.quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def build_search_params(
+    profile: CollectionProfile | None = None,
+    hnsw_ef: int | None = None,
+    exact: bool | None = None,
+) -> models.SearchParams:
+    """
+    密ベクトル検索のパラメータを組み立てる。hnsw_ef / exact はリクエストごとに上書きできる。
+    """
+    profile = profile or get_collection_profile()
+    quantization = None
+    if profile.quantization:
+        quantization = models.QuantizationSearchParams(
+            rescore=profile.rescore,
+            oversampling=profile.oversampling,
+        )
+    return models.SearchParams(
+        hnsw_ef=hnsw_ef if hnsw_ef is not None else settings.QDRANT_HNSW_EF,
+        exact=exact if exact is not None else settings.QDRANT_EXACT_SEARCH,
+        quantization=quantization,
+    )
+
 
 # グローバル変数
 _client = None
 
+# コレクションが dense + sparse の名前付きベクトル構成かどうか (init_collection か初回の利用時に判定)
+_hybrid_collections: dict[str, bool] = {}
+
+def _has_sparse_vector(info: models.CollectionInfo) -> bool:
+    return SPARSE_VECTOR_NAME in (info.config.params.sparse_vectors or {})
+
+async def is_hybrid_collection(collection_name: str) -> bool:
+    """
+    コレクションの構成を返す。init_collection が失敗した・まだ実行されていない場合は、
+    Qdrant からコレクションの構成を取得して判定する (構成を取得できるまでは毎回問い合わせる)。
+    """
+    if collection_name not in _hybrid_collections:
+        info = await get_qdrant_client().get_collection(collection_name)
+        _hybrid_collections[collection_name] = _has_sparse_vector(info)
+    return _hybrid_collections[collection_name]
+
+# コレクションごとの更新カウンタ。ドキュメントの取り込みが終わるたびに増え、検索結果キャッシュの無効化に使う
+_collection_versions: dict[str, int] = {}
+
+# ドキュメントごとに、最後に更新されたときのコレクションバージョン (回答キャッシュの無効化に使う)
+_document_versions: dict[tuple[str, str], int] = {}
+
+def get_collection_version(collection_name: str) -> int:
+    return _collection_versions.get(collection_name, 0)
+
+def bump_collection_version(collection_name: str) -> int:
+    _collection_versions[collection_name] = get_collection_version(collection_name) + 1
+    return _collection_versions[collection_name]
+
+def get_document_version(collection_name: str, document_id: str) -> int:
+    return _document_versions.get((collection_name, document_id), 0)
+
+def bump_document_version(collection_name: str, document_id: str) -> int:
+    """
+    ドキュメントの更新を記録する (コレクションバージョンも1つ進める)
+    """
+    version = bump_collection_version(collection_name)
+    _document_versions[(collection_name, document_id)] = version
+    return version
+
 def get_qdrant_client() -> AsyncQdrantClient: # 型定義変更
     """
     Qdrantの非同期クライアントを返す (Singleton)
     """
     global _client
+    if _client is None and settings.QDRANT_HOST == ":memory:":
+        _client = AsyncQdrantClient(location=":memory:")
     if _client is None:
         _client = AsyncQdrantClient( # ここをAsyncに変更
             url=settings.QDRANT_HOST,
@@ -18,19 +147,165 @@ def get_qdrant_client() -> AsyncQdrantClient: # 型定義変更
         )
     return _client
 
-async def init_collection(collection_name: str, vector_size: int = 768): # asyncをつける
+async def init_collection(collection_name: str, vector_size: int = 768, profile: str | None = None): # asyncをつける
     """
     コレクションの初期化 (非同期版)
+
+    HYBRID_SEARCH_ENABLED の場合は、密ベクトル (dense) と BM25 用の疎ベクトル (bm25) を
+    名前付きベクトルとして持つコレクションを作る。既存のコレクションは構成を確認し、
+    名前なしの密ベクトルのみの旧構成であれば密ベクトル検索だけで動作する。
+    フィルタ検索用のペイロードインデックス (PAYLOAD_INDEXES) は、既存のコレクションにも不足分を作成する。
+    量子化・ディスク配置・HNSWの設定は profile (未指定なら QDRANT_COLLECTION_PROFILE) に従う。
     """
     client = get_qdrant_client()
+    collection_profile = get_collection_profile(profile)
     
     # 非同期メソッドなので await が必要
     if not await client.collection_exists(collection_name):
+        dense_params = models.VectorParams(
+            size=vector_size,
+            distance=models.Distance.COSINE,
+            on_disk=collection_profile.on_disk
+        )
         await client.create_collection(
             collection_name=collection_name,
-            vectors_config=models.VectorParams(
-                size=vector_size,
-                distance=models.Distance.COSINE
-            )
+            vectors_config={DENSE_VECTOR_NAME: dense_params} if settings.HYBRID_SEARCH_ENABLED else dense_params,
+            # IDF は Qdrant 側でコレクション全体の統計から計算する
+            sparse_vectors_config={
+                SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)
+            } if settings.HYBRID_SEARCH_ENABLED else None,
+            hnsw_config=models.HnswConfigDiff(
+                m=collection_profile.hnsw_m,
+                ef_construct=collection_profile.hnsw_ef_construct,
+                on_disk=collection_profile.hnsw_on_disk
+            ),
+            quantization_config=_quantization_config(collection_profile)
+        )
+        print(f"Collection '{collection_name}' created.")
+
+    info = await client.get_collection(collection_name)
+    vectors = info.config.params.vectors
+    dense = vectors.get(DENSE_VECTOR_NAME) if isinstance(vectors, dict) else vectors
+    if dense is not None and dense.size != vector_size:
+        logger.error(
+            f"Collection '{collection_name}' has dimension {dense.size}, but the embedding backend "
+            f"produces {vector_size}. Recreate the collection or switch EMBEDDING_BACKEND."
+        )
+    _hybrid_collections[collection_name] = _has_sparse_vector(info)
+    if settings.HYBRID_SEARCH_ENABLED and not _hybrid_collections[collection_name]:
+        logger.warning(
+            f"Collection '{collection_name}' has no '{SPARSE_VECTOR_NAME}' sparse vector; "
+            "hybrid search is disabled for it (recreate the collection to enable)."
+        )
+
+    # ペイロードインデックスの作成 (既にあるものはスキップ)
+    for field_name, field_schema in PAYLOAD_INDEXES.items():
+        if field_name in (info.payload_schema or {}):
+            continue
+        await client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=field_schema,
+            wait=True
         )
-        print(f"Collection '{collection_name}' created.")
\ No newline at end of file
+        print(f"Payload index '{field_name}' ({field_schema.value}) created on '{collection_name}'.")
+
+
+class BatchUpserter:
+    """
+    ポイントを固定サイズのバッチに区切って順次 upsert するライター。
+
+    - バッチは wait=False で送信し、Qdrant側の反映を待たずに次のバッチを準備する
+    - 送信中のバッチ数は max_in_flight で制限し、超えた場合は add() が待つ (背圧)
+    - 失敗したバッチだけを指数バックオフで再送する
+    - close() で残りを wait=True で送り、それまでの更新が反映されたことを確認する
+      (最後のバッチは close() まで手元に残すため、ポイント数がバッチサイズの倍数でも必ず wait=True で終わる)
+    - コレクションバージョンは進めない (呼び出し元がドキュメント単位で bump_document_version する)
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        batch_size: int = settings.UPSERT_BATCH_SIZE,
+        max_in_flight: int = settings.UPSERT_MAX_IN_FLIGHT,
+        max_retries: int = settings.UPSERT_MAX_RETRIES,
+        on_batch_saved: Callable[[int], Awaitable[None]] | None = None,
+    ):
+        self.client = get_qdrant_client()
+        self.collection_name = collection_name
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.on_batch_saved = on_batch_saved
+        self.saved = 0
+        self._buffer: list[models.PointStruct] = []
+        self._semaphore = asyncio.Semaphore(max(1, max_in_flight))
+        self._tasks: set[asyncio.Task] = set()
+        self._error: BaseException | None = None
+
+    async def add(self, point: models.PointStruct):
+        self._raise_if_failed()
+        self._buffer.append(point)
+        # 次のポイントが来てから送る。満杯のバッチを1つ残しておき、最後の送信を close() の wait=True にする
+        if len(self._buffer) > self.batch_size:
+            await self._send(wait=False)
+
+    async def close(self) -> int:
+        """
+        残りのポイントを送信し、全バッチの完了を待つ。保存したポイント数を返す。
+        """
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._raise_if_failed()
+        if self._buffer:
+            await self._send(wait=True)
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._raise_if_failed()
+        return self.saved
+
+    async def abort(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._buffer.clear()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    async def _send(self, wait: bool):
+        batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+        # 送信枠が空くまで待つ (ここでバッファの増加が止まる)
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._upsert_with_retry(batch, wait))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _upsert_with_retry(self, batch: list[models.PointStruct], wait: bool):
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with span("upsert"):
+                        await self.client.upsert(
+                            collection_name=self.collection_name,
+                            points=batch,
+                            wait=wait,
+                        )
+                    break
+                except Exception as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = 0.5 * (2 ** attempt)
+                    logger.warning(
+                        f"Upsert of {len(batch)} points failed ({e}), "
+                        f"retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})"
+                    )
+                    await asyncio.sleep(delay)
+
+            self.saved += len(batch)
+            if self.on_batch_saved:
+                await self.on_batch_saved(self.saved)
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+        finally:
+            self._semaphore.release()
@@ -1,35 +1,74 @@
+import logging
+import re
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware 
 from app.api import documents, search, chat
 from app.core.config import settings
 from app.db.vector_store import init_collection
-from app.api import documents, search, chat, agent
+from app.api import documents, search, chat, agent, metrics
+from app.core.metrics import histogram
+from app.core.tracing import format_summary, new_trace_id, start_trace
 from app.services.mcp_client import mcp_client
+from app.services.embeddings import close_embedding_engine, get_embedding_engine
+from app.services.extractor import shutdown_extraction_executor
+from app.services.jobs import get_job_queue
+from app.services import rerank
+from app.services.generation import get_generation_model
+from app.services.agent_runner import get_agent_model
+
+logger = logging.getLogger(__name__)
+
+HTTP_SECONDS = histogram(
+    "docubrain_http_request_duration_seconds",
+    "HTTP request duration in seconds (until the response headers for streaming responses).",
+    ("method", "route", "status"),
+)
+# 外部から受け取るトレースIDとして許す形式 (ログやヘッダーを汚さないよう制限する)
+TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
 
 
 # ライフサイクルイベント
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 起動時
+    # 起動時 (どれかが失敗しても、残りの初期化は続ける)
+    print("🚀 Starting up DocuBrain-Agent...")
     try:
-        print("🚀 Starting up DocuBrain-Agent...")
-        await init_collection("docubrain_collection", vector_size=768)
+        # コレクションの次元は埋め込みバックエンドの次元に合わせる
+        await init_collection("docubrain_collection", vector_size=get_embedding_engine().dimension)
         print("✅ Connected to Qdrant successfully!")
+    except Exception as e:
+        print(f"❌ Failed to initialize Qdrant collection: {e}")
+
+    # Qdrant が起動していなくてもワーカーは動かす (ジョブは取り込みの時点で失敗として記録される)
+    try:
+        await get_job_queue().start()
+        print("✅ Ingestion workers started")
+    except Exception as e:
+        print(f"❌ Failed to start ingestion workers: {e}")
 
-        try:
-            await mcp_client.connect()
-        except Exception as e:
-            print(f"❌ Failed to connect to MCP Server: {e}")
+    try:
+        rerank.warmup()
+        # Geminiのモデルとツール宣言を先に組み立てておく (リクエストごとには作らない)
+        get_generation_model()
+        get_agent_model()
+    except Exception as e:
+        print(f"❌ Failed to prepare models: {e}")
 
+    try:
+        await mcp_client.connect()
     except Exception as e:
-        print(f"❌ Failed to connect to Qdrant: {e}")
+        print(f"❌ Failed to connect to MCP Server: {e}")
     
     yield
     
     # 終了時
     print("🛑 Shutting down...")
+    await get_job_queue().stop()
     await mcp_client.close()
+    close_embedding_engine()
+    shutdown_extraction_executor()
 
 app = FastAPI(
     title=settings.PROJECT_NAME, 
@@ -46,11 +85,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    リクエストごとにトレースを開始し、所要時間をメトリクスに記録する。
+    トレースIDはレスポンスヘッダーで返し、遅いリクエストは段階ごとの内訳をログに出す。
+    """
+    incoming = request.headers.get(settings.TRACE_HEADER, "")
+    trace = start_trace(incoming if TRACE_ID_PATTERN.match(incoming) else new_trace_id())
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers[settings.TRACE_HEADER] = trace.trace_id
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        # ラベルの種類が増えすぎないよう、パスではなくルートのテンプレートを使う
+        route = request.scope.get("route")
+        HTTP_SECONDS.observe(
+            elapsed,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status_code,
+        )
+        if elapsed >= settings.TRACE_SLOW_REQUEST_SECONDS:
+            logger.warning(
+                f"🐢 Slow request {request.method} {request.url.path} ({elapsed:.2f}s) "
+                f"trace={trace.trace_id}: {format_summary(trace) or 'no stages recorded'}"
+            )
+
 # ルーターの登録
 app.include_router(documents.router, prefix="/api", tags=["Documents"])
 app.include_router(search.router, prefix="/api", tags=["Search"])
 # app.include_router(chat.router, prefix="/api", tags=["Chat"])
+# /api/chat はエージェントが使っているため、RAGチャット (/chat, /chat/stream) は /api/rag 配下に置く
+app.include_router(chat.router, prefix="/api/rag", tags=["Chat"])
 app.include_router(agent.router, prefix="/api", tags=["Agent"])
+app.include_router(metrics.router, tags=["Metrics"])
 
 @app.get("/health")
 def health_check():
@@ -1,18 +1,22 @@
 from mcp.server.fastmcp import FastMCP
+from mcp.types import ToolAnnotations
 
 # MCPサーバーの定義
 mcp = FastMCP("MathServer")
 
-@mcp.tool()
+# 副作用がなく、同じ引数なら常に同じ結果を返すツール (クライアント側で結果をキャッシュできる)
+PURE_TOOL = ToolAnnotations(readOnlyHint=True, idempotentHint=True, openWorldHint=False)
+
+@mcp.tool(annotations=PURE_TOOL)
 def add(a: int, b: int) -> int:
     """2つの数を足し算します"""
     return a + b
 
-@mcp.tool()
+@mcp.tool(annotations=PURE_TOOL)
 def multiply(a: int, b: int) -> int:
     """2つの数を掛け算します"""
     return a * b
 
 if __name__ == "__main__":
     # 標準入出力(stdio)を使って通信します
-    mcp.run()
\ No newline at end of file
+    mcp.run()
@@ -1,8 +1,40 @@
 # app/schemas/document.py
-from pydantic import BaseModel
+from datetime import datetime
+from pydantic import BaseModel, Field
 
 class UploadResponse(BaseModel):
+    job_id: str = Field(..., description="取り込みジョブのID (GET /api/documents/{job_id} で進捗を確認できる)")
     filename: str
     content_type: str
-    extracted_text_preview: str  # 全文ではなく先頭100文字などを返す想定
-    message: str
\ No newline at end of file
+    # 抽出はバックグラウンドで行うため、アップロード直後は未確定 (None)
+    extracted_text_preview: str | None = None
+    message: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    filename: str
+    status: str = Field(..., description="queued / running / completed / failed")
+    pages: int = Field(0, description="抽出済みのページ数")
+    chunks_embedded: int = Field(0, description="ベクトル化済みのチャンク数")
+    points_upserted: int = Field(0, description="Qdrantに保存済みのポイント数")
+    tags: list[str] = Field(default_factory=list, description="アップロード時に付けたタグ")
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class BulkFileResult(BaseModel):
+    filename: str
+    job_id: str | None = Field(None, description="受け付けたファイルの取り込みジョブID")
+    status: str = Field(..., description="queued / running / completed / failed / rejected")
+    pages: int = 0
+    chunks_embedded: int = 0
+    points_upserted: int = 0
+    error: str | None = None
+
+
+class BulkUploadResponse(BaseModel):
+    batch_id: str = Field(..., description="一括取り込みのID (GET /api/documents/batches/{batch_id} で進捗を確認できる)")
+    accepted: int = Field(..., description="取り込みジョブとして登録したファイル数")
+    rejected: int = Field(..., description="受け付けなかったファイル数")
+    files: list[BulkFileResult]
@@ -1,16 +1,43 @@
+from datetime import datetime
 from pydantic import BaseModel, Field
 
+# 検索対象の絞り込み条件 (指定した条件はすべて満たすもののみ返す)
+class SearchFilters(BaseModel):
+    filenames: list[str] | None = Field(None, description="対象にするファイル名 (いずれかに一致)")
+    document_ids: list[str] | None = Field(None, description="対象にするドキュメントID (いずれかに一致)")
+    tags: list[str] | None = Field(None, description="アップロード時に付けたタグ (いずれかを含む)")
+    uploaded_after: datetime | None = Field(None, description="この日時以降にアップロードされたもの")
+    uploaded_before: datetime | None = Field(None, description="この日時以前にアップロードされたもの")
+
 # 検索リクエスト (ユーザーが送ってくるデータ)
 class SearchRequest(BaseModel):
     query: str = Field(..., description="ユーザーの質問")
-    limit: int = Field(5, description="取得するドキュメントの数")
+    limit: int = Field(5, ge=1, le=100, description="取得するドキュメントの数 (1〜100)")
+    filters: SearchFilters | None = Field(None, description="検索対象の絞り込み条件")
+    hnsw_ef: int | None = Field(None, ge=1, le=4096, description="HNSWの探索幅 (1〜4096。大きいほど正確で遅い。未指定ならサーバー設定)")
+    exact: bool | None = Field(None, description="HNSWを使わず全件比較する (未指定ならサーバー設定)")
 
 # 検索結果の1件分 (AIが見つけたドキュメントの断片)
 class SearchResultItem(BaseModel):
     text: str
     filename: str
     score: float # 類似度スコア (0〜1)
+    # チャンクの位置 (隣接チャンクの結合や前後の取得に使う。古いデータでは None)
+    document_id: str | None = None
+    chunk_index: int | None = None
+    page: int | None = None
+    start: int | None = None  # ドキュメント全体での文字オフセット
+    end: int | None = None
 
 # 検索レスポンス全体 (APIが返すデータ)
 class SearchResponse(BaseModel):
-    results: list[SearchResultItem]
\ No newline at end of file
+    results: list[SearchResultItem]
+
+
+# 一括検索リクエスト
+class BatchSearchRequest(BaseModel):
+    queries: list[SearchRequest] = Field(..., description="検索条件のリスト (結果はこの順序で返す)")
+
+# 一括検索レスポンス
+class BatchSearchResponse(BaseModel):
+    results: list[SearchResponse]
@@ -1,148 +1,253 @@
+import asyncio
+import time
 import traceback
 import logging
 import google.generativeai as genai
 from google.generativeai.types import content_types
-from collections.abc import Iterable
+from collections.abc import AsyncIterator, Iterable
 from app.core.config import settings
-from app.services.agent_tools import AGENT_TOOLS, add, multiply, retrieve_knowledge
+from app.core.tracing import record, span
+from app.services.agent_tools import AGENT_TOOLS, SEARCH_ERROR_MESSAGE
+from app.services.gemini import configure_gemini
+from app.services.answer_cache import answer_cache, embed_question, current_version, retrieve_source_ids
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# APIキー設定
-if settings.GEMINI_API_KEY:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
+# 【修正】ユーザー指定の gemini-2.5-flash に変更
+AGENT_MODEL_NAME = "gemini-2.5-flash"
 
-# ツール名と実際の関数を紐付けるマップ
-TOOL_MAP = {
-    "add": add,
-    "multiply": multiply,
-    "retrieve_knowledge": retrieve_knowledge
-}
+# ツール名と実際の関数を紐付けるマップ (Geminiに登録したツールと常に一致させる)
+TOOL_MAP = {tool.__name__: tool for tool in AGENT_TOOLS}
+
+# ツールの関数宣言 (関数のシグネチャとdocstringから生成するスキーマ)。起動時に1度だけ組み立てる
+AGENT_TOOL_LIBRARY = content_types.to_function_library(AGENT_TOOLS)
+
+# グローバル変数
+_agent_model = None
+
+def get_agent_model() -> genai.GenerativeModel:
+    """
+    ツールを登録済みのエージェント用モデルを返す (Singleton)
+    会話の履歴はリクエストごとの ChatSession が持つため、モデル自体は全リクエストで共有できる。
+    """
+    global _agent_model
+    if _agent_model is None:
+        configure_gemini()
+        _agent_model = genai.GenerativeModel(
+            model_name=AGENT_MODEL_NAME,
+            tools=AGENT_TOOL_LIBRARY
+        )
+    return _agent_model
 
 # 無限ループ防止のための最大反復回数
 MAX_ITERATIONS = 10
 
-async def run_agent_chat(user_message: str) -> str:
+# ストリーミングで送るツール結果の最大文字数 (全文はGeminiにだけ渡す)
+TOOL_RESULT_PREVIEW_CHARS = 500
+
+def _jsonable(value):
     """
-    Function Callingを使ってツールを実行しながら回答するエージェント
-    複数のツール呼び出しをループで処理します。
+    Function Calling の引数 (protoのMap/RepeatedComposite) をJSONに変換できる形にする
+    """
+    if hasattr(value, "items"):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)) or type(value).__name__.startswith("Repeated"):
+        return [_jsonable(v) for v in value]
+    return value
+
+def _text_of(chunk) -> str:
+    """
+    ストリーミングのチャンクからテキスト部分だけを取り出す
+    """
+    if not chunk.candidates or not chunk.candidates[0].content:
+        return ""
+    return "".join(part.text for part in chunk.candidates[0].content.parts if part.text)
+
+def _function_response_part(tool_name: str, response: dict):
+    """
+    ツールの実行結果を Gemini に返す FunctionResponse のパートにする
     """
     try:
-        logger.info(f"🚀 [Agent] Starting chat with message: {user_message[:100]}")
+        from google.generativeai import protos
         
-        # ツールを登録してモデルを初期化
-        logger.info(f"🔧 [Agent] Initializing model with {len(AGENT_TOOLS)} tools")
-        
-        # 【修正】ユーザー指定の gemini-2.5-flash に変更
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-flash',
-            tools=AGENT_TOOLS
+        return protos.Part(
+            function_response=protos.FunctionResponse(
+                name=tool_name,
+                response=response
+            )
         )
+    except ImportError:
+        logger.info("🔄 [Agent] Using alternative FunctionResponse construction")
+        return content_types.to_part({
+            "function_response": {
+                "name": tool_name,
+                "response": response
+            }
+        })
+
+async def _execute_tool(tool_name: str, args: dict) -> dict:
+    """
+    ツールを制限時間付きで実行し、Gemini に返す response ({"result": ...} か {"error": ...}) を返す。
+    失敗してもエージェントのループは止めず、エラー内容をそのまま Gemini に伝えて判断させる。
+    """
+    if tool_name not in TOOL_MAP:
+        logger.error(f"❌ [Agent] Unknown tool requested: {tool_name}")
+        return {"error": f"ツール '{tool_name}' は利用できません。"}
+    try:
+        logger.info(f"🔧 [Agent] Executing tool: {tool_name}")
+        
+        # 引数を展開して実行
+        with span(f"tool:{tool_name}"):
+            tool_result = await asyncio.wait_for(TOOL_MAP[tool_name](**args), timeout=settings.AGENT_TOOL_TIMEOUT)
+        logger.info(f"✅ [Agent] Tool result: {str(tool_result)[:200]}...")
+        return {"result": tool_result}
+    except asyncio.TimeoutError:
+        logger.error(f"❌ [Agent] Tool {tool_name} timed out after {settings.AGENT_TOOL_TIMEOUT}s")
+        return {"error": f"ツール '{tool_name}' が制限時間内に完了しませんでした。"}
+    except Exception as tool_error:
+        error_trace = traceback.format_exc()
+        logger.error(f"❌ [Agent] Tool execution failed:\n{error_trace}")
+        return {"error": f"ツール '{tool_name}' の実行中にエラーが発生しました: {str(tool_error)}"}
+
+def _is_tool_failure(response: dict) -> bool:
+    """
+    ツールの実行が失敗したか (例外・時間切れ・検索エラーの文字列を返した場合)
+    """
+    return "error" in response or response.get("result") == SEARCH_ERROR_MESSAGE
+
+async def run_agent_events(user_message: str) -> AsyncIterator[tuple[str, dict]]:
+    """
+    エージェントのループを実行し、進捗を (イベント名, データ) として順に返す非同期ジェネレータ。
+    Geminiの応答はストリーミングで受け取り、テキストは届いた順に token として返す。
+
+    イベント:
+        token: 生成されたテキストの断片 ({"text": ...})
+        tool_call: ツールの呼び出し開始 ({"name": ..., "args": {...}})
+        tool_result: ツールの実行結果 ({"name": ..., "result": 先頭部分} / 失敗時は {"name": ..., "error": ...})
+        done: 最終回答 ({"reply": ...})。エラー時もメッセージを reply に入れて必ず最後に返す。
+              回答キャッシュから返した場合は {"reply": ..., "cached": true}
+    """
+    try:
+        logger.info(f"🚀 [Agent] Starting chat with message: {user_message[:100]}")
+        started = time.perf_counter()
+
+        # 0. 回答キャッシュ確認 (言い換えを含め、同じ質問への最近の回答があればそれを返す)
+        # バージョンは先に取得し、処理中に取り込みがあれば保存した回答が無効になるようにする
+        # 同じ質問でも根拠の資料が違えば別の回答になるため、今検索される資料と照合する
+        version = current_version()
+        question_vector = await embed_question(user_message)
+        documents = None
+        if question_vector is not None:
+            documents = await retrieve_source_ids(user_message)
+        if documents is not None:
+            hit = answer_cache.lookup("agent", user_message, question_vector, documents)
+            if hit is not None:
+                reply, similarity = hit
+                logger.info(f"⚡ [Agent] Answer cache hit (similarity={similarity:.3f})")
+                yield "done", {"reply": reply, "cached": True}
+                return
         
         # チャットセッション開始 (手動で関数呼び出しを処理)
-        chat = model.start_chat(enable_automatic_function_calling=False)
+        # モデルとツールの宣言は共有のものを使い、リクエストごとには作り直さない
+        chat = get_agent_model().start_chat(enable_automatic_function_calling=False)
         logger.info("✅ [Agent] Chat session started")
         
-        # 1. ユーザーの入力を送信
+        # 1. ユーザーの入力を送信 (以降、Geminiへの送信はすべてストリーミング)
         logger.info("📤 [Agent] Sending user message to Gemini...")
-        response = await chat.send_message_async(user_message)
-        logger.info("📥 [Agent] Received response from Gemini")
+        message = user_message
+        # ツールが1つでも失敗したターンの回答 (謝罪など) はキャッシュしない
+        tool_failed = False
         
         # 2. ループ処理: AIが「関数を使いたい」と言っている間は繰り返す
         iteration = 0
         while iteration < MAX_ITERATIONS:
             iteration += 1
             logger.info(f"🔄 [Agent] Iteration {iteration}/{MAX_ITERATIONS}")
+            iteration_started = time.perf_counter()
+
+            # 応答をストリーミングで受け取り、テキストは届いた順に送る
+            response = await chat.send_message_async(message, stream=True)
+            streamed = []
+            async for chunk in response:
+                if text := _text_of(chunk):
+                    streamed.append(text)
+                    yield "token", {"text": text}
+            record("gemini_turn", time.perf_counter() - iteration_started)
+            logger.info("📥 [Agent] Received response from Gemini")
             
             # responseの構造を確認
             if not response.candidates:
                 logger.warning("⚠️ [Agent] No candidates in response")
-                return "すみません、応答を生成できませんでした。"
+                yield "done", {"reply": "すみません、応答を生成できませんでした。"}
+                return
             
             candidate = response.candidates[0]
             if not candidate.content or not candidate.content.parts:
                 logger.warning("⚠️ [Agent] No content parts in response")
-                return "すみません、応答を生成できませんでした。"
-            
-            part = candidate.content.parts[0]
+                yield "done", {"reply": "すみません、応答を生成できませんでした。"}
+                return
             
-            # function_callが含まれているか確認
-            if hasattr(part, 'function_call') and part.function_call:
-                fc = part.function_call
-                tool_name = fc.name
-                args = dict(fc.args)  # Mapをdictに変換
+            # function_call をすべて集める (1回の応答で複数のツールを呼ぶことがある)
+            calls = [(p.function_call.name, dict(p.function_call.args)) for p in candidate.content.parts if p.function_call]
+            if calls:
+                for tool_name, args in calls:
+                    logger.info(f"🤖 [Agent] AI wants to call: {tool_name} with args={args}")
+                    yield "tool_call", {"name": tool_name, "args": _jsonable(args)}
                 
-                logger.info(f"🤖 [Agent] AI wants to call: {tool_name} with args={args}")
+                # 3. すべてのツールを並行して実行し、結果をまとめて1回でAIに送り返す
+                tool_responses = await asyncio.gather(*(_execute_tool(name, args) for name, args in calls))
+                tool_failed = tool_failed or any(_is_tool_failure(response) for response in tool_responses)
+                for (tool_name, _), tool_response in zip(calls, tool_responses):
+                    yield "tool_result", {
+                        "name": tool_name,
+                        **{key: str(value)[:TOOL_RESULT_PREVIEW_CHARS] for key, value in tool_response.items()}
+                    }
                 
-                # 実際にツールを実行
-                if tool_name in TOOL_MAP:
-                    try:
-                        tool_func = TOOL_MAP[tool_name]
-                        logger.info(f"🔧 [Agent] Executing tool: {tool_name}")
-                        
-                        # 引数を展開して実行
-                        tool_result = await tool_func(**args)
-                        logger.info(f"✅ [Agent] Tool result: {str(tool_result)[:200]}...")
-                        
-                        # 3. 結果をAIに送り返す
-                        # FunctionResponseを使って結果を構築
-                        try:
-                            from google.generativeai import protos
-                            
-                            function_response_part = protos.Part(
-                                function_response=protos.FunctionResponse(
-                                    name=tool_name,
-                                    response={"result": tool_result}
-                                )
-                            )
-                        except ImportError:
-                            logger.info("🔄 [Agent] Using alternative FunctionResponse construction")
-                            function_response_part = content_types.to_part({
-                                "function_response": {
-                                    "name": tool_name,
-                                    "response": {"result": tool_result}
-                                }
-                            })
-                        
-                        # AIに結果を渡して、次の応答を生成させる
-                        logger.info("📤 [Agent] Sending tool result back to Gemini...")
-                        response = await chat.send_message_async([function_response_part])
-                        logger.info("📥 [Agent] Received next response from Gemini")
-                        
-                        # ループを継続して次の関数呼び出しをチェック
-                        continue
-                        
-                    except Exception as tool_error:
-                        error_trace = traceback.format_exc()
-                        logger.error(f"❌ [Agent] Tool execution failed:\n{error_trace}")
-                        return f"ツール '{tool_name}' の実行中にエラーが発生しました: {str(tool_error)}"
-                else:
-                    logger.error(f"❌ [Agent] Unknown tool requested: {tool_name}")
-                    return f"すみません、ツール '{tool_name}' は利用できません。"
+                logger.info(f"📤 [Agent] Sending {len(calls)} tool result(s) back to Gemini...")
+                message = [
+                    _function_response_part(tool_name, tool_response)
+                    for (tool_name, _), tool_response in zip(calls, tool_responses)
+                ]
+                record("agent_iteration", time.perf_counter() - iteration_started)
+                
+                # ループを継続して次の関数呼び出しをチェック
+                continue
             else:
                 # 関数呼び出しがなければ、テキスト応答を返す
                 logger.info("💬 [Agent] No function call, returning text response")
-                if hasattr(response, 'text'):
-                    text_content = response.text
-                    if text_content:
-                        logger.info(f"✅ [Agent] Final response: {text_content[:100]}...")
-                        return text_content
-                    else:
-                        logger.warning("⚠️ [Agent] Response object has text attribute but it is empty.")
-                        return "すみません、空の応答が返されました。"
+                record("agent_iteration", time.perf_counter() - iteration_started)
+                text_content = "".join(streamed)
+                if text_content:
+                    logger.info(f"✅ [Agent] Final response: {text_content[:100]}...")
+                    if documents is not None and not tool_failed:
+                        answer_cache.store(
+                            "agent", user_message, question_vector, version, documents,
+                            text_content, time.perf_counter() - started
+                        )
+                    yield "done", {"reply": text_content}
                 else:
-                    logger.warning("⚠️ [Agent] No text in response")
-                    return "すみません、応答を生成できませんでした。"
+                    logger.warning("⚠️ [Agent] Response has no text.")
+                    yield "done", {"reply": "すみません、空の応答が返されました。"}
+                return
         
         # 最大反復回数に達した場合
         logger.warning(f"⚠️ [Agent] Reached max iterations ({MAX_ITERATIONS})")
-        if hasattr(response, 'text') and response.text:
-            return response.text
-        return "処理が複雑すぎるため、完了できませんでした。"
+        yield "done", {"reply": "".join(streamed) or "処理が複雑すぎるため、完了できませんでした。"}
 
     except Exception as e:
         error_trace = traceback.format_exc()
-        logger.error(f"❌ [Agent] Fatal error in run_agent_chat:\n{error_trace}")
-        return f"すみません、処理中にエラーが発生しました: {str(e)}"
\ No newline at end of file
+        logger.error(f"❌ [Agent] Fatal error in run_agent_events:\n{error_trace}")
+        yield "done", {"reply": f"すみません、処理中にエラーが発生しました: {str(e)}"}
+
+async def run_agent_chat(user_message: str) -> str:
+    """
+    Function Callingを使ってツールを実行しながら回答するエージェント
+    複数のツール呼び出しをループで処理します。(run_agent_events の最終回答だけを返す)
+    """
+    reply = "すみません、応答を生成できませんでした。"
+    async for event, data in run_agent_events(user_message):
+        if event == "done":
+            reply = data["reply"]
+    return reply
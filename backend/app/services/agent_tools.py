@@ -1,5 +1,12 @@
+import asyncio
 from app.services.mcp_client import mcp_client
-from app.services.search import search_relevant_documents
+from app.services.context import assemble_context
+from app.core.config import settings
+from app.services.search import search_relevant_documents, search_relevant_documents_batch
+from app.schemas.search import SearchFilters, SearchRequest
+
+# 検索ツールが失敗したときに返すメッセージ (エージェントはこれを含むターンの回答をキャッシュしない)
+SEARCH_ERROR_MESSAGE = "検索中にエラーが発生しました。"
 
 # === 既存の計算ツール (現状維持) ===
 async def add(a: int, b: int) -> int:
@@ -32,32 +39,72 @@ async def multiply(a: int, b: int) -> int:
         return 0
 
 # === 【追加】検索ツール (ここが新機能！) ===
-async def retrieve_knowledge(query: str) -> str:
+async def retrieve_knowledge(query: str, filename: str = "", tag: str = "", uploaded_after: str = "") -> str:
     """
     社内ドキュメント（履歴書や職務経歴書など）を検索して情報を取得します。
     ユーザーから候補者のスキル、経歴、経験などに関する質問があった場合にこのツールを使用してください。
+    特定の候補者のファイルやタグ、期間に絞って調べたい場合は filename / tag / uploaded_after を指定してください。
     
     Args:
         query: 検索したいキーワードや質問文
+        filename: 検索対象を絞り込むファイル名 (例: "yamada_resume.pdf")。空なら全ドキュメント
+        tag: 検索対象を絞り込むタグ。空なら絞り込まない
+        uploaded_after: この日付 (YYYY-MM-DD) 以降にアップロードされたものに絞り込む。空なら絞り込まない
     """
     print(f"🔍 [Agent Tool] Searching for knowledge: {query}")
     
     try:
+        filters = None
+        if filename or tag or uploaded_after:
+            filters = SearchFilters(
+                filenames=[filename] if filename else None,
+                tags=[tag] if tag else None,
+                uploaded_after=uploaded_after or None
+            )
+
         # 既存のRAG検索を実行 (Top 5)
-        results = await search_relevant_documents(query=query, limit=5)
+        results = await search_relevant_documents(query=query, limit=5, filters=filters)
         
         if not results:
             return "関連する情報は見つかりませんでした。"
         
-        # 検索結果をLLMが読みやすいテキストに整形
-        context_text = "\n\n".join(
-            [f"[Source: {r.filename}]\n{r.text}" for r in results]
-        )
-        return context_text
+        # 検索結果をLLMが読みやすいテキストに整形 (隣接チャンクの結合・重複の除去・トークン数の上限)
+        return "\n\n".join(await assemble_context(results))
     except Exception as e:
         print(f"❌ [Tool Error] search failed: {e}")
-        return "検索中にエラーが発生しました。"
+        return SEARCH_ERROR_MESSAGE
+
+async def retrieve_knowledge_multi(queries: list[str]) -> str:
+    """
+    複数の質問について、社内ドキュメント（履歴書や職務経歴書など）をまとめて検索します。
+    「AさんとBさんの経験を比較して」のように、1つの質問を複数の小さな質問に分けて調べる場合は、
+    retrieve_knowledge を何度も呼ぶ代わりにこのツールを1回呼んでください。
+
+    Args:
+        queries: 検索したいキーワードや質問文のリスト
+    """
+    queries = [q for q in queries if q.strip()][:settings.SEARCH_BATCH_MAX_QUERIES]
+    print(f"🔍 [Agent Tool] Searching for knowledge (batch): {queries}")
+
+    try:
+        # 埋め込みと検索をそれぞれ1回にまとめて実行 (各 Top 5)
+        results = await search_relevant_documents_batch(
+            [SearchRequest(query=q, limit=5) for q in queries]
+        )
+
+        # トークン数の上限はクエリ間で等分する
+        budget = settings.CONTEXT_MAX_TOKENS // max(len(queries), 1)
+        contexts = await asyncio.gather(*(assemble_context(items, max_tokens=budget) for items in results))
+
+        sections = []
+        for query, context in zip(queries, contexts):
+            body = "\n\n".join(context)
+            sections.append(f"## {query}\n{body or '関連する情報は見つかりませんでした。'}")
+        return "\n\n".join(sections) if sections else "関連する情報は見つかりませんでした。"
+    except Exception as e:
+        print(f"❌ [Tool Error] batch search failed: {e}")
+        return SEARCH_ERROR_MESSAGE
 
 # === ツール登録 ===
 # ここに retrieve_knowledge を追加することで、Geminiが「この機能があるんだ」と認識します
-AGENT_TOOLS = [add, multiply, retrieve_knowledge]
\ No newline at end of file
+AGENT_TOOLS = [add, multiply, retrieve_knowledge, retrieve_knowledge_multi]
\ No newline at end of file
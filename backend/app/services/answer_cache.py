@@ -0,0 +1,252 @@
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+from app.core.config import settings
+from app.db.vector_store import get_collection_version, get_document_version
+from app.services.embeddings import get_embedding
+from app.schemas.search import SearchResultItem
+from app.services.search import search_relevant_documents
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "docubrain_collection"
+
+# 質問の埋め込みの用途 (検索クエリと同じにして、埋め込みキャッシュを検索と共有する)
+QUESTION_TASK_TYPE = "retrieval_query"
+
+# 回答の根拠となる資料を調べるときの検索件数 (RAGチャットの検索件数と揃える)
+SOURCE_LIMIT = 5
+
+# 質問の対象を表す語 (人名・ファイル名・固有名詞など) の抽出パターン
+_QUOTED = re.compile(r"[「『\"“]([^」』\"”]+)[」』\"”]")
+_HONORIFIC_NAME = re.compile(r"([\u30a0-\u30ff\u4e00-\u9fffA-Za-z]{1,10})(?:さん|様|氏|くん|君|ちゃん)")
+_ASCII_WORD = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.+#-]*")
+_CJK = re.compile(r"[\u3040-\u30ff\u4e00-\u9fff]")
+# 英語の質問で文頭に来やすい (大文字で始まっても対象ではない) 語
+_QUESTION_WORDS = frozenset({
+    "what", "who", "whom", "whose", "where", "when", "why", "how", "which", "is", "are", "was", "were",
+    "do", "does", "did", "can", "could", "would", "should", "will", "has", "have", "had", "tell", "show",
+    "list", "give", "find", "please", "summarize", "describe", "explain", "compare", "i", "the", "a", "an",
+})
+
+
+def extract_key_terms(question: str) -> frozenset[str]:
+    """
+    質問の対象を表す語を取り出す。回答キャッシュは、この集合が一致する質問どうしでのみヒットさせる。
+
+    「山田さんのPythonスキルは？」と「佐藤さんのPythonスキルは？」のように、対象だけが違う質問は
+    埋め込みがほとんど変わらないため、類似度だけで判定すると別の人の回答を返してしまう。
+    抽出するのは、括弧や引用符で囲まれた語・敬称の付いた名前・英数字の語
+    (日本語の質問では英数字の語をすべて、英語の質問では大文字で始まる語 (疑問詞などを除く) と数字を含む語)。
+    """
+    terms = {match.strip().casefold() for match in _QUOTED.findall(question)}
+    terms.update(name.casefold() for name in _HONORIFIC_NAME.findall(question))
+    words = _ASCII_WORD.findall(question)
+    if _CJK.search(question):
+        terms.update(word.casefold() for word in words)
+    else:
+        terms.update(
+            word.casefold() for word in words
+            if any(c.isdigit() for c in word) or (word[0].isupper() and word.casefold() not in _QUESTION_WORDS)
+        )
+    return frozenset(terms)
+
+
+@dataclass
+class _Entry:
+    namespace: str
+    question: str
+    key_terms: frozenset[str]
+    document_ids: tuple[str, ...]  # 回答の根拠となった資料 (検索の順位順)
+    vector: np.ndarray  # 正規化済み
+    value: Any
+    version: int  # 回答を作り始めたときのコレクションバージョン
+    stored_at: float
+    elapsed: float
+
+
+class SemanticAnswerCache:
+    """
+    質問ベクトルの類似度で引く回答キャッシュ (プロセス内の小さなインデックス)。
+
+    - 過去の質問とのコサイン類似度が threshold 以上なら、その回答を返す (言い換えにも当たる)
+    - 根拠の資料のどれかが、回答を作り始めた後に取り込み直されたエントリは無効になる
+      (関係のない資料の取り込みでは消えない。新しい資料が検索されるようになった質問は、資料の照合で外れる)
+    - namespace ごとに独立して引く (エージェントとRAGチャットの回答は混ぜない)
+    - 質問に対して今検索される資料 (document_id を順位順に並べたもの) が、回答を作ったときと同じエントリだけを候補にする
+      (「山田太郎の経歴」と「佐藤花子の経歴」のように埋め込みが近くても、根拠の資料やその順位が違えば別の質問とみなす)
+    - さらに質問の対象を表す語 (extract_key_terms: 人名・ファイル名など) が一致するものに限る
+    - 件数の上限を超えたら、最も長く使われていないものから捨てる (LRU)
+    """
+
+    def __init__(self, max_entries: int, ttl: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: list[_Entry] = []
+        self._matrix: np.ndarray | None = None  # _entries のベクトルを並べた行列 (変更時に作り直す)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    @staticmethod
+    def _is_current(entry: _Entry) -> bool:
+        return all(
+            get_document_version(COLLECTION_NAME, document_id) <= entry.version
+            for document_id in entry.document_ids
+        )
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        alive = [e for e in self._entries if now - e.stored_at <= self.ttl and self._is_current(e)]
+        if len(alive) != len(self._entries):
+            self._entries = alive
+            self._matrix = None
+
+    def lookup(
+        self,
+        namespace: str,
+        question: str,
+        vector: list[float],
+        document_ids: tuple[str, ...],
+    ) -> tuple[Any, float] | None:
+        """
+        最も近い過去の質問の (回答, 類似度) を返す。しきい値未満なら None。
+        document_ids は、この質問で今検索された資料 (source_ids) 。
+        """
+        if not self.enabled:
+            return None
+        query = self._normalize(vector)
+        key_terms = extract_key_terms(question)
+        with self._lock:
+            self._evict_expired()
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix = np.stack([e.vector for e in self._entries])
+            similarities = self._matrix @ query
+            # 別の namespace や、根拠の資料・質問の対象が異なるエントリは候補から外す
+            for i, entry in enumerate(self._entries):
+                if (
+                    entry.namespace != namespace
+                    or entry.document_ids != document_ids
+                    or entry.key_terms != key_terms
+                ):
+                    similarities[i] = -1.0
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            # LRU: 使ったエントリを末尾に移す
+            entry = self._entries.pop(best)
+            self._entries.append(entry)
+            self._matrix = None
+            self.hits += 1
+            self.saved_seconds += entry.elapsed
+            return entry.value, similarity
+
+    def store(
+        self,
+        namespace: str,
+        question: str,
+        vector: list[float],
+        version: int,
+        document_ids: tuple[str, ...],
+        value: Any,
+        elapsed: float,
+    ):
+        """
+        回答を保存する。version は回答を作り始める前に取得したもの (current_version)。
+        """
+        if not self.enabled:
+            return
+        entry = _Entry(
+            namespace, question, extract_key_terms(question), document_ids, self._normalize(vector),
+            value, version, time.monotonic(), elapsed
+        )
+        if not self._is_current(entry):
+            # 回答を作っている間に根拠の資料が取り込み直された
+            return
+        with self._lock:
+            self._entries.append(entry)
+            del self._entries[:-self.max_entries]
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
+
+
+# 回答キャッシュ (エージェント・RAGチャットで共有)
+answer_cache = SemanticAnswerCache(
+    settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL, settings.ANSWER_CACHE_THRESHOLD
+)
+
+
+async def embed_question(question: str) -> list[float] | None:
+    """
+    回答キャッシュを引くための質問ベクトルを返す。
+    キャッシュが無効な場合や、埋め込みに失敗した場合は None (キャッシュを使わずに処理を続ける)。
+    """
+    if not answer_cache.enabled:
+        return None
+    try:
+        return await get_embedding(question, task_type=QUESTION_TASK_TYPE)
+    except Exception as e:
+        logger.warning(f"Failed to embed question for answer cache: {e}")
+        return None
+
+
+def source_ids(results: list[SearchResultItem]) -> tuple[str, ...]:
+    """
+    検索結果の資料 (document_id。古いチャンクではファイル名) を、重複を除いて順位順に並べたもの
+    """
+    return tuple(dict.fromkeys(item.document_id or item.filename for item in results))
+
+
+async def retrieve_source_ids(question: str) -> tuple[str, ...] | None:
+    """
+    質問に対して今検索される資料を返す (自分では検索しないエージェントが、キャッシュの照合に使う)。
+    検索に失敗した場合は None (キャッシュを使わずに処理を続ける)。
+    """
+    try:
+        return source_ids(await search_relevant_documents(question, limit=SOURCE_LIMIT))
+    except Exception as e:
+        logger.warning(f"Failed to retrieve sources for answer cache: {e}")
+        return None
+
+
+def current_version() -> int:
+    return get_collection_version(COLLECTION_NAME)
@@ -1,29 +1,156 @@
-def split_text(text: str, chunk_size: int = 500, overlap: int = 50) -> list[str]:
+import re
+from collections.abc import AsyncIterator, Iterable, Iterator
+from dataclasses import dataclass
+from app.core.config import settings
+from app.core.tracing import span
+
+# 文末 (日本語の句点・感嘆符・疑問符と欧文の終止符) または段落区切り (空行) で文を区切る
+_SENTENCE_END = re.compile(r"[。！？!?]+[」』）)]*|\.(?=\s)|\n\s*\n")
+
+# CJK文字 (かな・漢字・全角記号) は1文字≒1トークン、それ以外は4文字≒1トークンとして見積もる
+_CJK = re.compile(r"[　-ヿ㐀-鿿豈-﫿＀-￯]")
+
+
+@dataclass
+class Chunk:
+    """
+    チャンク1つ分。start / end はドキュメント全体 (ページを "\n" で連結したテキスト) 上の文字オフセット。
+    """
+    text: str
+    start: int
+    end: int
+    page: int
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数を概算する (トークナイザを使わない軽量な見積もり)
+    """
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _iter_sentences(text: str) -> Iterator[tuple[int, int]]:
+    """
+    文の (start, end) を先頭から順に返す。テキストを1回走査するだけの線形時間。
+    """
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        if end > start:
+            yield start, end
+        start = end
+    if start < len(text):
+        yield start, len(text)
+
+
+def _split_long(start: int, end: int, text: str, max_tokens: int) -> Iterator[tuple[int, int]]:
+    """
+    1文だけで上限を超える場合に、上限に収まる長さで強制的に区切る
+    """
+    while start < end:
+        stop = start
+        tokens = 0
+        while stop < end and tokens < max_tokens:
+            # 上限に近づくまでは文字数ベースでまとめて進める
+            step = max(1, min(end - stop, max_tokens - tokens))
+            tokens += estimate_tokens(text[stop:stop + step])
+            stop += step
+        yield start, stop
+        start = stop
+
+
+def chunk_page(
+    text: str,
+    page: int = 1,
+    offset: int = 0,
+    max_tokens: int = settings.CHUNK_MAX_TOKENS,
+    overlap_tokens: int = settings.CHUNK_OVERLAP_TOKENS,
+) -> Iterator[Chunk]:
     """
-    テキストを指定された文字数で分割する。
-    
+    1ページ分のテキストを、文・段落の境界でトークン上限以内のチャンクに分割する。
+    チャンクはページをまたがない。隣り合うチャンクは末尾の数文 (overlap_tokens 以内) を共有する。
+
+    Args:
+        text: ページのテキスト
+        page: ページ番号 (1始まり)
+        offset: ドキュメント全体におけるこのページの開始位置
+    """
+    # (start, end, tokens) の文のリスト。現在組み立て中のチャンクの分だけ保持する
+    window: list[tuple[int, int, int]] = []
+    window_tokens = 0
+
+    def emit() -> Chunk | None:
+        start, end = window[0][0], window[-1][1]
+        chunk_text = text[start:end].strip()
+        if not chunk_text:
+            return None
+        # 前後の空白を除いた分だけオフセットも詰める
+        lead = len(text[start:end]) - len(text[start:end].lstrip())
+        return Chunk(chunk_text, offset + start + lead, offset + start + lead + len(chunk_text), page)
+
+    sentences = (
+        piece
+        for start, end in _iter_sentences(text)
+        for piece in _split_long(start, end, text, max_tokens)
+    )
+    for start, end in sentences:
+        tokens = estimate_tokens(text[start:end])
+        if window and window_tokens + tokens > max_tokens:
+            chunk = emit()
+            if chunk:
+                yield chunk
+            # 末尾の文をオーバーラップとして次のチャンクに引き継ぐ
+            carried: list[tuple[int, int, int]] = []
+            carried_tokens = 0
+            for sentence in reversed(window):
+                if carried_tokens + sentence[2] > overlap_tokens or carried_tokens + sentence[2] + tokens > max_tokens:
+                    break
+                carried.insert(0, sentence)
+                carried_tokens += sentence[2]
+            window, window_tokens = carried, carried_tokens
+        window.append((start, end, tokens))
+        window_tokens += tokens
+
+    if window:
+        chunk = emit()
+        if chunk:
+            yield chunk
+
+
+def iter_chunks(pages: Iterable[tuple[int, str]], **kwargs) -> Iterator[Chunk]:
+    """
+    (ページ番号, テキスト) の列を順にチャンク分割するジェネレータ
+    """
+    offset = 0
+    for page, text in pages:
+        yield from chunk_page(text, page=page, offset=offset, **kwargs)
+        offset += len(text) + 1  # ページ間の "\n" の分
+
+
+async def aiter_chunks(pages: AsyncIterator[tuple[int, str]], **kwargs) -> AsyncIterator[Chunk]:
+    """
+    ストリームで届くページ (非同期ジェネレータ) を、届いた順にチャンク分割する
+    """
+    offset = 0
+    async for page, text in pages:
+        with span("chunking"):
+            chunks = list(chunk_page(text, page=page, offset=offset, **kwargs))
+        for chunk in chunks:
+            yield chunk
+        offset += len(text) + 1
+
+
+def split_text(text: str, chunk_size: int = settings.CHUNK_MAX_TOKENS, overlap: int = settings.CHUNK_OVERLAP_TOKENS) -> list[str]:
+    """
+    テキストを文の境界でトークン上限以内に分割する。
+
     Args:
         text (str): 元のテキスト
-        chunk_size (int): 1つのチャンクの文字数
-        overlap (int): 前後のチャンクと重複させる文字数（文脈の分断を防ぐため）
-        
+        chunk_size (int): 1つのチャンクの最大トークン数
+        overlap (int): 前後のチャンクと重複させるトークン数（文脈の分断を防ぐため）
+
     Returns:
         list[str]: 分割されたテキストのリスト
     """
-    chunks = []
-    start = 0
-    text_len = len(text)
-
-    while start < text_len:
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        
-        # 次の開始位置を決める（overlap分だけ戻る）
-        # ただし、最後のチャンクの場合はループを抜ける
-        if end >= text_len:
-            break
-            
-        start += (chunk_size - overlap)
-        
-    return chunks
\ No newline at end of file
+    return [chunk.text for chunk in chunk_page(text, max_tokens=chunk_size, overlap_tokens=overlap)]
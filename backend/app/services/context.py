@@ -0,0 +1,231 @@
+import logging
+from dataclasses import dataclass
+from qdrant_client import models
+from app.core.config import settings
+from app.core.tracing import span
+from app.db.vector_store import get_qdrant_client
+from app.schemas.search import SearchResultItem
+from app.services.chunking import estimate_tokens
+from app.services.search import to_search_result
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "docubrain_collection"
+
+# オフセットを持たない古いチャンクで、文字列の一致からオーバーラップを探す最大文字数
+MAX_FALLBACK_OVERLAP_CHARS = 2000
+
+
+@dataclass
+class ContextBlock:
+    """
+    プロンプトに入れる参考情報の1ブロック。同じドキュメントの連続したチャンクを1つにまとめたもの。
+    """
+    filename: str
+    text: str
+    score: float  # まとめたチャンクのうち最も高いスコア
+    document_id: str | None = None
+    first_index: int | None = None
+    last_index: int | None = None
+    end: int | None = None  # 最後のチャンクの終了オフセット
+
+    def format(self) -> str:
+        return f"[Source: {self.filename}]\n{self.text}"
+
+
+def _text_overlap(left: str, right: str) -> int:
+    """
+    left の末尾と right の先頭で一致する最長の文字数
+    """
+    for size in range(min(len(left), len(right), MAX_FALLBACK_OVERLAP_CHARS), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _append(block: ContextBlock, item: SearchResultItem):
+    """
+    block の直後のチャンク item を、重複部分 (チャンク分割のオーバーラップ) を除いて block に足す
+    """
+    overlap = None
+    separator = ""
+    if block.end is not None and item.start is not None:
+        if item.start >= block.end:
+            overlap = 0
+            separator = "\n" if item.start > block.end else ""
+        elif block.text.endswith(item.text[:block.end - item.start]):
+            overlap = block.end - item.start
+    if overlap is None:
+        # オフセットがない、または内容が食い違う場合は文字列の一致から重複を探す
+        overlap = _text_overlap(block.text, item.text)
+        separator = "" if overlap else "\n"
+
+    block.text += separator + item.text[overlap:]
+    block.score = max(block.score, item.score)
+    block.last_index = item.chunk_index
+    if item.end is not None:
+        block.end = max(block.end or 0, item.end)
+
+
+def _new_block(item: SearchResultItem) -> ContextBlock:
+    return ContextBlock(
+        filename=item.filename,
+        text=item.text,
+        score=item.score,
+        document_id=item.document_id,
+        first_index=item.chunk_index,
+        last_index=item.chunk_index,
+        end=item.end
+    )
+
+
+def merge_adjacent(items: list[SearchResultItem]) -> list[ContextBlock]:
+    """
+    同じドキュメントで chunk_index が連続するヒットを1ブロックにまとめ、重複部分を取り除く。
+    同じチャンクが複数回含まれていれば1つにする。ブロックはスコアの高い順に返す。
+    """
+    blocks: list[ContextBlock] = []
+    groups: dict[str, dict[int, SearchResultItem]] = {}
+    seen_texts: set[str] = set()
+    for item in items:
+        if item.chunk_index is None:
+            # 位置の分からない古いチャンクは、そのまま1ブロックにする
+            if item.text not in seen_texts:
+                seen_texts.add(item.text)
+                blocks.append(_new_block(item))
+            continue
+        group = groups.setdefault(item.document_id or item.filename, {})
+        current = group.get(item.chunk_index)
+        if current is None or item.score > current.score:
+            group[item.chunk_index] = item
+
+    for group in groups.values():
+        block = None
+        for chunk_index in sorted(group):
+            item = group[chunk_index]
+            if block is not None and chunk_index == block.last_index + 1:
+                _append(block, item)
+            else:
+                block = _new_block(item)
+                blocks.append(block)
+
+    return sorted(blocks, key=lambda block: block.score, reverse=True)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """
+    先頭から max_tokens (概算) に収まる長さまで切り詰める
+    """
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def pack_context(items: list[SearchResultItem], max_tokens: int | None = None) -> list[ContextBlock]:
+    """
+    検索結果をプロンプト用の参考情報にまとめる。
+
+    1. 隣接するチャンクを結合し、チャンク分割のオーバーラップで重複した部分を取り除く
+    2. スコアの高いブロックから順に、合計が max_tokens (未指定なら CONTEXT_MAX_TOKENS) に収まる分だけ採用する
+       (収まらないブロックは飛ばし、後続の小さいブロックを詰める。最初のブロックだけは切り詰めてでも入れる)
+    """
+    budget = settings.CONTEXT_MAX_TOKENS if max_tokens is None else max_tokens
+    with span("context_packing"):
+        blocks = merge_adjacent(items)
+        selected: list[ContextBlock] = []
+        used = 0
+        for block in blocks:
+            tokens = estimate_tokens(block.format())
+            if used + tokens <= budget:
+                selected.append(block)
+                used += tokens
+            elif not selected:
+                header_tokens = estimate_tokens(block.format()) - estimate_tokens(block.text)
+                block.text = _truncate(block.text, max(budget - header_tokens, 0))
+                if block.text:
+                    selected.append(block)
+                    used += estimate_tokens(block.format())
+
+    logger.info(
+        f"Packed {len(items)} hits into {len(selected)}/{len(blocks)} context blocks "
+        f"({used} tokens, budget {budget})"
+    )
+    return selected
+
+
+async def expand_neighbors(
+    items: list[SearchResultItem],
+    window: int | None = None,
+    hits: int | None = None,
+) -> list[SearchResultItem]:
+    """
+    上位 hits 件のヒットについて、前後 window 個のチャンクを取得して items に加える。
+    必要なチャンクは document_id と chunk_index の条件で、1回の scroll でまとめて取得する。
+    加えたチャンクには元のヒットのスコアを付ける (pack_context で元のヒットと結合される)。
+    取得に失敗した場合は items をそのまま返す。
+    """
+    window = settings.CONTEXT_NEIGHBOR_CHUNKS if window is None else window
+    hits = settings.CONTEXT_NEIGHBOR_HITS if hits is None else hits
+    if window <= 0:
+        return items
+
+    present = {(item.document_id, item.chunk_index) for item in items}
+    wanted: dict[str, set[int]] = {}
+    scores: dict[tuple[str, int], float] = {}
+    for item in items[:hits]:
+        if item.document_id is None or item.chunk_index is None:
+            continue
+        for offset in range(-window, window + 1):
+            key = (item.document_id, item.chunk_index + offset)
+            if key[1] < 0 or key in present:
+                continue
+            wanted.setdefault(key[0], set()).add(key[1])
+            scores[key] = max(scores.get(key, 0.0), item.score)
+    if not scores:
+        return items
+
+    query_filter = models.Filter(should=[
+        models.Filter(must=[
+            models.FieldCondition(key="document_id", match=models.MatchValue(value=document_id)),
+            models.FieldCondition(key="chunk_index", match=models.MatchAny(any=sorted(indexes)))
+        ])
+        for document_id, indexes in wanted.items()
+    ])
+    try:
+        with span("neighbor_fetch"):
+            points, _ = await get_qdrant_client().scroll(
+                collection_name=COLLECTION_NAME,
+                scroll_filter=query_filter,
+                limit=len(scores),
+                with_payload=True,
+                with_vectors=False
+            )
+    except Exception as e:
+        logger.warning(f"Failed to fetch neighbor chunks: {e}")
+        return items
+
+    neighbors = []
+    for point in points:
+        key = (point.payload.get("document_id"), point.payload.get("chunk_index"))
+        if key in scores:
+            neighbors.append(to_search_result(point.payload, scores[key]))
+    return items + neighbors
+
+
+async def assemble_context(
+    items: list[SearchResultItem],
+    max_tokens: int | None = None,
+    neighbors: int | None = None,
+) -> list[str]:
+    """
+    検索結果から、プロンプトに入れる参考情報のテキスト ([Source: ファイル名] 付き) のリストを作る
+    """
+    if not items:
+        return []
+    items = await expand_neighbors(items, window=neighbors)
+    return [block.format() for block in pack_context(items, max_tokens)]
@@ -0,0 +1,129 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+
+def normalize_text(text: str) -> str:
+    """
+    キャッシュキー用にテキストを正規化する (前後の空白除去・連続する空白/改行を1つにまとめる)
+    """
+    return " ".join(text.split())
+
+
+def make_cache_key(model: str, task_type: str, text: str) -> str:
+    """
+    モデル名・用途・正規化済みテキストから内容アドレス型のキーを作る
+    """
+    raw = f"{model}\x00{task_type}\x00{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DiskEmbeddingStore:
+    """
+    SQLite にベクトルを float32 のバイト列として保存する永続キャッシュ層
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self._lock:
+            # SQLite のパラメータ数上限を超えないよう分割して問い合わせる
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: dict[str, list[float]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingCache:
+    """
+    埋め込みベクトルのキャッシュ
+
+    - 1段目: プロセス内の LRU (max_entries 件まで)
+    - 2段目: SQLite による永続層 (disk_path を指定した場合のみ)
+    """
+
+    def __init__(self, max_entries: int, disk_path: str | None = None):
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = DiskEmbeddingStore(disk_path) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_memory(self, key: str) -> list[float] | None:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            return vector
+
+    def put_memory(self, key: str, vector: list[float]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get_disk_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """
+        永続層から取得し、見つかったものはメモリ層にも載せる (同期処理)
+        """
+        found = self.disk.get_many(keys) if self.disk else {}
+        for key, vector in found.items():
+            self.put_memory(key, vector)
+        with self._lock:
+            self.disk_hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_disk_many(self, items: dict[str, list[float]]):
+        if self.disk and items:
+            self.disk.put_many(items)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        if self.disk:
+            self.disk.close()
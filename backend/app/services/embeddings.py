@@ -1,37 +1,369 @@
+import asyncio
+import hashlib
+import importlib
+import logging
+import random
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Protocol
+
+import numpy as np
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from app.core.config import settings
+from app.core.tracing import span
+from app.services.embedding_cache import EmbeddingCache, make_cache_key
+from app.services.gemini import configure_gemini
+
+logger = logging.getLogger(__name__)
+
+# レート制限・一時的な障害とみなしてリトライするエラー
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,  # 429: レート制限
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
 
-# 初期設定: APIキーを読み込む
-if settings.GEMINI_API_KEY:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
 
-async def get_embedding(text: str) -> list[float]:
+def _clean_text(text: str) -> str:
+    # 改行コードは埋め込み精度に悪影響を与えることがあるため置換するのが定石です
+    return text.replace("\n", " ")
+
+
+class EmbeddingBackend(Protocol):
     """
-    Gemini API (text-embedding-004) を使用してテキストをベクトル化する。
-    
-    Args:
-        text (str): ベクトル化したいテキスト
-        
-    Returns:
-        list[float]: 768次元のベクトルリスト
+    埋め込みバックエンドのインターフェース。
+
+    - model: キャッシュキーに使うモデル名 (モデルが変わればキャッシュも別になる)
+    - dimension: ベクトルの次元数 (Qdrant コレクションの次元と一致させる)
+    - embed_batch: テキストのリストを同じ順序のベクトルのリストに変換する同期処理
     """
-    if not settings.GEMINI_API_KEY:
-        raise ValueError("GEMINI_API_KEY is not set in environment variables.")
+    model: str
+    dimension: int
+
+    def embed_batch(self, texts: list[str], task_type: str) -> list[list[float]]: ...
+
+
+class GeminiEmbeddingBackend:
+    """
+    Gemini API (text-embedding-004) を使ったバックエンド。
+    1回のリクエストで複数テキストをまとめてベクトル化する。
+    """
+
+    def __init__(self, model: str = settings.EMBEDDING_MODEL, dimension: int = settings.EMBEDDING_DIMENSION):
+        self.model = model
+        self.dimension = dimension
+        configure_gemini()
+
+    def embed_batch(self, texts: list[str], task_type: str) -> list[list[float]]:
+        if not settings.GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY is not set in environment variables.")
 
-    try:
-        # 改行コードは埋め込み精度に悪影響を与えることがあるため置換するのが定石です
-        clean_text = text.replace("\n", " ")
-        
-        # 実務ポイント: 最新モデルを指定します
         result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=clean_text,
-            task_type="retrieval_document" # 用途を指定（検索用ドキュメント）
+            model=self.model,
+            content=[_clean_text(t) for t in texts],
+            task_type=task_type,
         )
-        
-        return result['embedding']
-        
+        return result["embedding"]
+
+
+class FakeEmbeddingBackend:
+    """
+    ネットワークを使わない決定的なダミーバックエンド。
+    同じテキストには常に同じ単位ベクトルを返すため、オフラインでのスループット計測に使える。
+    """
+
+    def __init__(self, dimension: int = settings.EMBEDDING_DIMENSION, latency: float = settings.EMBEDDING_FAKE_LATENCY):
+        self.model = f"fake-{dimension}"
+        self.dimension = dimension
+        self.latency = latency
+
+    def _seed(self, text: str, task_type: str) -> int:
+        digest = hashlib.sha256(f"{task_type}:{_clean_text(text)}".encode("utf-8")).digest()
+        return struct.unpack("<Q", digest[:8])[0]
+
+    def embed_batch(self, texts: list[str], task_type: str) -> list[list[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        vectors = np.stack([
+            np.random.default_rng(self._seed(t, task_type)).standard_normal(self.dimension)
+            for t in texts
+        ])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors.tolist()
+
+
+class LocalEmbeddingBackend:
+    """
+    sentence-transformers 形式のモデルをローカルCPUで動かすバックエンド。
+    ネットワーク不要のため、エアギャップ環境やオフラインのベンチマークで使える。
+    (sentence-transformers を別途インストールする必要がある)
+    """
+
+    def __init__(
+        self,
+        model: str = settings.LOCAL_EMBEDDING_MODEL,
+        batch_size: int = settings.LOCAL_EMBEDDING_BATCH_SIZE,
+    ):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = model
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model, device="cpu")
+        self.dimension = self._model.get_sentence_embedding_dimension()
+        # e5 系モデルは用途に応じた接頭辞を付けて学習されている
+        self._prefixes = {
+            "retrieval_query": settings.LOCAL_EMBEDDING_QUERY_PREFIX,
+            "retrieval_document": settings.LOCAL_EMBEDDING_DOCUMENT_PREFIX,
+        }
+
+    def embed_batch(self, texts: list[str], task_type: str) -> list[list[float]]:
+        prefix = self._prefixes.get(task_type, "")
+        # NumPy 配列のままバッチで推論し、最後にまとめてリストに変換する
+        vectors = self._model.encode(
+            [prefix + _clean_text(t) for t in texts],
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.astype(np.float32).tolist()
+
+
+EMBEDDING_BACKENDS = {
+    "gemini": GeminiEmbeddingBackend,
+    "fake": FakeEmbeddingBackend,
+    "local": LocalEmbeddingBackend,
+}
+
+
+def _resolve_backend(name: str) -> type:
+    """
+    バックエンド名から実装クラスを返す。"package.module:ClassName" 形式で独自実装も指定できる。
+    """
+    if name in EMBEDDING_BACKENDS:
+        return EMBEDDING_BACKENDS[name]
+    if ":" in name:
+        module_name, class_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), class_name)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {name}")
+
+
+# 同期的な埋め込みAPIを実行する専用のスレッドプール
+# asyncio のデフォルトExecutorを共有しないことで、他の to_thread 処理と枯渇し合わないようにする
+_executor: ThreadPoolExecutor | None = None
+
+def get_embedding_executor() -> ThreadPoolExecutor:
+    """
+    埋め込み専用のスレッドプールを返す (Singleton)
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.EMBEDDING_EXECUTOR_WORKERS),
+            thread_name_prefix="embedding",
+        )
+    return _executor
+
+def shutdown_embedding_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class EmbeddingEngine:
+    """
+    大量のテキストをバッチにまとめてベクトル化するエンジン。
+
+    - テキストを batch_size 件ずつのリクエストに詰める
+    - 同時に実行するバッチ数を max_concurrency で制限する
+    - レート制限 (429) などの一時的なエラーは指数バックオフでリトライする
+    - 同期APIは専用スレッドプールで実行し、イベントループをブロックしない
+    - cache を渡すと、同じモデル・用途・テキストの再計算を省略する
+    - 複数の呼び出し元 (別々のドキュメントや検索) からのテキストを同じバッチに相乗りさせる
+    """
+
+    def __init__(
+        self,
+        backend: EmbeddingBackend,
+        cache: EmbeddingCache | None = None,
+        batch_size: int = settings.EMBEDDING_BATCH_SIZE,
+        max_concurrency: int = settings.EMBEDDING_MAX_CONCURRENCY,
+        max_retries: int = settings.EMBEDDING_MAX_RETRIES,
+        retry_base_delay: float = settings.EMBEDDING_RETRY_BASE_DELAY,
+        batch_linger: float = settings.EMBEDDING_BATCH_LINGER,
+    ):
+        self.backend = backend
+        self.dimension = backend.dimension
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.batch_linger = batch_linger
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        # 用途 (task_type) ごとの送信待ちテキストと、その結果を受け取る Future
+        self._pending: dict[str, list[tuple[str, asyncio.Future]]] = {}
+        self._linger_handles: dict[str, asyncio.TimerHandle] = {}
+        self._batch_tasks: set[asyncio.Task] = set()
+
+    async def _embed_with_retry(self, texts: list[str], task_type: str) -> list[list[float]]:
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    loop = asyncio.get_running_loop()
+                    with span("embedding_api"):
+                        return await loop.run_in_executor(
+                            get_embedding_executor(), self.backend.embed_batch, texts, task_type
+                        )
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    # ジッター付き指数バックオフ
+                    delay = self.retry_base_delay * (2 ** attempt) * (0.5 + random.random())
+                    logger.warning(
+                        f"Embedding batch failed ({type(e).__name__}), "
+                        f"retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})"
+                    )
+                    await asyncio.sleep(delay)
+
+    async def embed(self, texts: list[str], task_type: str = "retrieval_document") -> list[list[float]]:
+        """
+        テキストのリストをベクトル化する。戻り値の順序は入力と同じ。
+        """
+        if not texts:
+            return []
+        if self.cache is None:
+            return await self._embed_uncached(texts, task_type)
+
+        keys = [make_cache_key(self.backend.model, task_type, t) for t in texts]
+        found: dict[str, list[float]] = {}
+        for key in keys:
+            vector = self.cache.get_memory(key)
+            if vector is not None:
+                found[key] = vector
+
+        # メモリにないものは永続層 → API の順に探す (同じキーは1回だけ問い合わせる)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            found.update(await asyncio.to_thread(self.cache.get_disk_many, list(missing)))
+            missing = {key: text for key, text in missing.items() if key not in found}
+
+        if missing:
+            vectors = await self._embed_uncached(list(missing.values()), task_type)
+            computed = dict(zip(missing.keys(), vectors))
+            for key, vector in computed.items():
+                self.cache.put_memory(key, vector)
+            await asyncio.to_thread(self.cache.put_disk_many, computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    async def _embed_uncached(self, texts: list[str], task_type: str) -> list[list[float]]:
+        """
+        テキストを送信待ちキューに積み、バッチの結果を待つ。
+        batch_size に達したバッチはすぐ送信し、端数は batch_linger 秒だけ他の呼び出し元を待ってから送信する。
+        """
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in texts]
+        self._pending.setdefault(task_type, []).extend(zip(texts, futures))
+
+        while len(self._pending[task_type]) >= self.batch_size:
+            self._dispatch(task_type, self.batch_size)
+        if self._pending[task_type] and task_type not in self._linger_handles:
+            self._linger_handles[task_type] = loop.call_later(
+                self.batch_linger, self._dispatch_lingering, task_type
+            )
+
+        return list(await asyncio.gather(*futures))
+
+    def _dispatch_lingering(self, task_type: str):
+        self._linger_handles.pop(task_type, None)
+        while self._pending.get(task_type):
+            self._dispatch(task_type, self.batch_size)
+
+    def _dispatch(self, task_type: str, size: int):
+        queue = self._pending[task_type]
+        items, self._pending[task_type] = queue[:size], queue[size:]
+        if not self._pending[task_type]:
+            handle = self._linger_handles.pop(task_type, None)
+            if handle:
+                handle.cancel()
+        task = asyncio.get_running_loop().create_task(self._run_batch(items, task_type))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, items: list[tuple[str, asyncio.Future]], task_type: str):
+        try:
+            vectors = await self._embed_with_retry([text for text, _ in items], task_type)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(items, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+# グローバル変数
+_engine = None
+
+def get_embedding_engine() -> EmbeddingEngine:
+    """
+    設定に応じたバックエンドを持つ EmbeddingEngine を返す (Singleton)
+    """
+    global _engine
+    if _engine is None:
+        backend_cls = _resolve_backend(settings.EMBEDDING_BACKEND)
+        cache = None
+        if settings.EMBEDDING_CACHE_SIZE > 0 or settings.EMBEDDING_CACHE_PATH:
+            cache = EmbeddingCache(settings.EMBEDDING_CACHE_SIZE, settings.EMBEDDING_CACHE_PATH)
+        _engine = EmbeddingEngine(backend_cls(), cache=cache)
+    return _engine
+
+def close_embedding_engine():
+    """
+    エンジンとスレッドプールを解放する (アプリ終了時に呼ぶ)
+    """
+    global _engine
+    if _engine is not None and _engine.cache is not None:
+        _engine.cache.close()
+    _engine = None
+    shutdown_embedding_executor()
+
+
+async def get_embeddings(texts: list[str], task_type: str = "retrieval_document") -> list[list[float]]:
+    """
+    複数のテキストをまとめてベクトル化する。
+
+    Args:
+        texts (list[str]): ベクトル化したいテキストのリスト
+        task_type (str): 埋め込みの用途
+
+    Returns:
+        list[list[float]]: 入力と同じ順序のベクトルのリスト
+    """
+    try:
+        with span("embedding"):
+            return await get_embedding_engine().embed(texts, task_type=task_type)
     except Exception as e:
-        print(f"Error generating embedding: {e}")
-        # リトライ処理などを入れる場所ですが、まずはエラーを送出
-        raise e
\ No newline at end of file
+        print(f"Error generating embeddings: {e}")
+        raise e
+
+
+async def get_embedding(text: str, task_type: str = "retrieval_document") -> list[float]:
+    """
+    設定された埋め込みバックエンド (デフォルトは Gemini text-embedding-004) でテキストをベクトル化する。
+
+    Args:
+        text (str): ベクトル化したいテキスト
+        task_type (str): 埋め込みの用途 (デフォルトは検索用ドキュメント)
+
+    Returns:
+        list[float]: バックエンドの次元数 (Gemini は768次元) のベクトルリスト
+    """
+    vectors = await get_embeddings([text], task_type=task_type)
+    return vectors[0]
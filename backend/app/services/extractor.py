@@ -1,32 +1,191 @@
 # app/services/extractor.py
+import asyncio
+import os
+import shutil
+import tempfile
+import zipfile
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
 from pypdf import PdfReader
 from fastapi import UploadFile
-import io
+from app.core.config import settings
+from app.core.tracing import span
+
+# アップロードを一時ファイルに書き出す際の読み込み単位
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+# pypdf の処理はCPUバウンドなので、別プロセスで実行してイベントループとGILから切り離す
+_executor: ProcessPoolExecutor | None = None
+
+def get_extraction_executor() -> ProcessPoolExecutor:
+    """
+    PDF抽出用のプロセスプールを返す (Singleton)
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max(1, settings.PDF_EXTRACT_WORKERS))
+    return _executor
+
+def shutdown_extraction_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _make_spool_file(suffix: str) -> tuple[int, str]:
+    spool_dir = settings.UPLOAD_SPOOL_DIR
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+    return tempfile.mkstemp(suffix=suffix, dir=spool_dir)
+
+
+async def spool_upload(file: UploadFile, suffix: str = ".pdf") -> str:
+    """
+    アップロードされたファイルを少しずつ一時ファイルに書き出し、そのパスを返す。
+    ファイル全体をメモリに載せないため、大きなPDFでもメモリ使用量は一定。
+    """
+    fd, path = _make_spool_file(suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await file.read(SPOOL_CHUNK_SIZE):
+                await asyncio.to_thread(f.write, chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def _is_archive_metadata(member_name: str) -> bool:
+    """
+    macOS が ZIP に含める AppleDouble ファイル (__MACOSX/ 以下や ._ で始まるもの) か
+    """
+    parts = member_name.split("/")
+    return parts[0] == "__MACOSX" or parts[-1].startswith("._")
+
+
+def spool_zip_members(
+    zip_path: str, max_members: int, max_total_bytes: int
+) -> list[tuple[str, str | None, str | None]]:
+    """
+    ZIPアーカイブ内のPDFを1つずつ一時ファイルに展開する (同期処理。スレッドで実行すること)。
+
+    展開する前に、ヘッダーの展開サイズで1ファイルあたりの上限・圧縮率の上限 (BULK_MAX_COMPRESSION_RATIO)・
+    展開するファイルの合計 (max_total_bytes) を確認し、超えるものは展開しない (ZIP爆弾対策)。
+
+    ファイル名はアーカイブ内の相対パス (例: "a/resume.pdf") のまま返す。
+    ドキュメントIDはファイル名から決まるため、別のフォルダにある同名のファイルを区別する必要がある。
+    macOS のメタデータ (__MACOSX/ や ._*) は結果に含めない。
+
+    Returns:
+        (ファイル名, 一時ファイルのパス, エラー) のリスト。展開できなかったものはパスが None。
+    """
+    results = []
+    accepted = 0
+    total_bytes = 0
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            name = info.filename.replace("\\", "/").lstrip("/")
+            if name.startswith("./"):
+                name = name[2:]
+            if _is_archive_metadata(name):
+                continue
+            if not name.lower().endswith(".pdf"):
+                results.append((name, None, "Only PDF files are allowed."))
+                continue
+            if accepted >= max_members:
+                results.append((name, None, "Too many files in one request."))
+                continue
+            if info.file_size > settings.BULK_MAX_MEMBER_BYTES:
+                results.append((name, None, "File is too large."))
+                continue
+            if info.file_size > settings.BULK_MAX_COMPRESSION_RATIO * max(info.compress_size, 1):
+                results.append((name, None, "Compression ratio is too high."))
+                continue
+            if total_bytes + info.file_size > max_total_bytes:
+                results.append((name, None, "Archive contents are too large in total."))
+                continue
+
+            fd, path = _make_spool_file(".pdf")
+            try:
+                with archive.open(info) as src, os.fdopen(fd, "wb") as dst:
+                    shutil.copyfileobj(src, dst, SPOOL_CHUNK_SIZE)
+            except Exception as e:
+                os.remove(path)
+                results.append((name, None, f"Failed to extract from archive: {e}"))
+                continue
+            results.append((name, path, None))
+            accepted += 1
+            total_bytes += info.file_size
+    return results
+
+
+def _count_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+def _extract_page_range(path: str, start: int, end: int) -> list[str]:
+    """
+    [start, end) のページのテキストを抽出する (プロセスプール内で実行される)
+    """
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+async def iter_pdf_pages(path: str) -> AsyncIterator[tuple[int, str]]:
+    """
+    PDFのページを並列に抽出し、(ページ番号, テキスト) をページ順に1つずつ返す非同期ジェネレータ。
+    ページ番号は1始まり。
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_extraction_executor()
+
+    num_pages = await loop.run_in_executor(executor, _count_pages, path)
+    step = max(1, settings.PDF_PAGES_PER_TASK)
+
+    # 先読みするタスク数を制限し、抽出済みテキストが溜まりすぎないようにする
+    max_pending = max(1, settings.PDF_EXTRACT_WORKERS) * 2
+    ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+    pending: list[asyncio.Future] = []
+    next_range = 0
+
+    try:
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < max_pending:
+                start, end = ranges[next_range]
+                pending.append(loop.run_in_executor(executor, _extract_page_range, path, start, end))
+                next_range += 1
+
+            start, _ = ranges[next_range - len(pending)]
+            with span("extraction"):
+                texts = await pending.pop(0)
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
+    finally:
+        for future in pending:
+            future.cancel()
+
 
 async def extract_text_from_pdf(file: UploadFile) -> str:
     """
     アップロードされたPDFファイルからテキストを抽出する
     """
+    path = None
     try:
-        # UploadFileは非同期で読み込む必要があります
-        content = await file.read()
-        
-        # メモリ上のバイナリデータとして扱う
-        pdf_file = io.BytesIO(content)
-        reader = PdfReader(pdf_file)
-        
-        text = ""
+        path = await spool_upload(file)
+
         # 全ページのテキストを結合
-        for page in reader.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
-        
+        texts = [text async for _, text in iter_pdf_pages(path) if text]
+
         # 読み込みカーソルをリセット（後続処理のため）
         await file.seek(0)
-        
-        return text.strip()
+
+        return "\n".join(texts).strip()
     except Exception as e:
         # 実務ではログ出力推奨
         print(f"Error extracting text: {e}")
-        return ""
\ No newline at end of file
+        return ""
+    finally:
+        if path:
+            os.remove(path)
@@ -0,0 +1,22 @@
+import threading
+import google.generativeai as genai
+from app.core.config import settings
+
+_configured = False
+_lock = threading.Lock()
+
+def configure_gemini():
+    """
+    genai.configure を最初の1回だけ実行する。
+
+    genai.configure は呼ぶたびに内部のAPIクライアント (gRPC チャネル) を破棄して作り直すため、
+    モジュールごとに呼ぶと接続が使い回されない。埋め込み・回答生成・エージェントはすべてここを経由し、
+    同じクライアントを共有する。
+    """
+    global _configured
+    if _configured:
+        return
+    with _lock:
+        if not _configured and settings.GEMINI_API_KEY:
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+        _configured = True
@@ -1,41 +1,60 @@
 import google.generativeai as genai
 from app.core.config import settings
+from app.core.tracing import record, span
+from app.services.gemini import configure_gemini
 import logging
 import asyncio
+import time
+from collections.abc import AsyncIterator
 
 logger = logging.getLogger(__name__)
 
-# Geminiの設定 (APIキーはすでに設定済みのはず)
-if settings.GEMINI_API_KEY:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-
 # 高速で安価なモデルを選択 (gemini-2.5-flash - 最新のFlashモデル)
 # Note: 古いライブラリバージョンでは generate_content_async がサポートされていない可能性があるため
 # 同期版を asyncio.to_thread でラップします
 MODEL_NAME = "gemini-2.5-flash"
 
+# 生成に失敗した場合に回答の代わりに返すメッセージ
+API_KEY_ERROR_ANSWER = "エラー: Gemini APIキーが設定されていません。環境変数を確認してください。"
+GENERATION_ERROR_PREFIX = "回答生成中にエラーが発生しました"
+
+def is_error_answer(answer: str) -> bool:
+    """
+    generate_answer の戻り値が、回答ではなくエラーメッセージかどうか
+    """
+    return answer == API_KEY_ERROR_ANSWER or answer.startswith(GENERATION_ERROR_PREFIX)
+
+# グローバル変数
+_model = None
+
+def get_generation_model() -> genai.GenerativeModel:
+    """
+    回答生成用のモデルを返す (Singleton)
+    GenerativeModel はリクエスト間で状態を持たないため、1つを全リクエストで共有する。
+    """
+    global _model
+    if _model is None:
+        configure_gemini()
+        _model = genai.GenerativeModel(MODEL_NAME)
+    return _model
+
 def _generate_sync(prompt: str) -> str:
     """
     同期的にGeminiで回答を生成する内部関数
     """
     try:
-        model = genai.GenerativeModel(MODEL_NAME)
-        response = model.generate_content(prompt)
+        response = get_generation_model().generate_content(prompt)
         return response.text
     except Exception as e:
         logger.error(f"Gemini API error during generation: {e}", exc_info=True)
         # APIキーが設定されていない場合のメッセージ
         if "API_KEY" in str(e).upper() or not settings.GEMINI_API_KEY:
-            return "エラー: Gemini APIキーが設定されていません。環境変数を確認してください。"
+            return API_KEY_ERROR_ANSWER
         raise
 
-async def generate_answer(query: str, context_texts: list[str]) -> str:
-    """
-    検索されたコンテキストを元に、Geminiで回答を生成する
-    """
-    if not context_texts:
-        return "申し訳ありません。関連する情報が見つかりませんでした。"
+NO_CONTEXT_ANSWER = "申し訳ありません。関連する情報が見つかりませんでした。"
 
+def _build_prompt(query: str, context_texts: list[str]) -> str:
     # コンテキストを結合してプロンプトに埋め込む
     context_str = "\n\n".join(context_texts)
     
@@ -50,11 +69,60 @@ async def generate_answer(query: str, context_texts: list[str]) -> str:
     
     ユーザーの質問: {query}
     """
+    return prompt
+
+async def generate_answer(query: str, context_texts: list[str]) -> str:
+    """
+    検索されたコンテキストを元に、Geminiで回答を生成する
+    """
+    if not context_texts:
+        return NO_CONTEXT_ANSWER
+
+    prompt = _build_prompt(query, context_texts)
 
     try:
         # 同期関数を非同期で実行 (ブロッキングを防ぐ)
-        answer = await asyncio.to_thread(_generate_sync, prompt)
+        with span("generation"):
+            answer = await asyncio.to_thread(_generate_sync, prompt)
         return answer
     except Exception as e:
         logger.error(f"Error in generate_answer: {e}", exc_info=True)
-        return f"回答生成中にエラーが発生しました: {str(e)}"
\ No newline at end of file
+        return f"{GENERATION_ERROR_PREFIX}: {str(e)}"
+
+def _start_stream_sync(prompt: str):
+    """
+    ストリーミング生成を開始し、チャンクのイテレータを返す (同期)
+    """
+    return iter(get_generation_model().generate_content(prompt, stream=True))
+
+def _next_text_sync(chunks) -> str | None:
+    """
+    次のチャンクのテキストを返す。終端なら None (同期)
+    """
+    for chunk in chunks:
+        # テキストを含まないチャンク (安全性評価のみ等) は読み飛ばす
+        parts = chunk.candidates[0].content.parts if chunk.candidates else []
+        text = "".join(part.text for part in parts if part.text)
+        if text:
+            return text
+    return None
+
+async def generate_answer_stream(query: str, context_texts: list[str]) -> AsyncIterator[str]:
+    """
+    generate_answer のストリーミング版。生成されたテキストを届いた順に返す。
+    同期版と同様に、Gemini の呼び出しはスレッドで実行してイベントループを塞がない。
+    """
+    if not context_texts:
+        yield NO_CONTEXT_ANSWER
+        return
+
+    prompt = _build_prompt(query, context_texts)
+    started = time.perf_counter()
+    chunks = await asyncio.to_thread(_start_stream_sync, prompt)
+    first = True
+    while (text := await asyncio.to_thread(_next_text_sync, chunks)) is not None:
+        if first:
+            record("generation_first_token", time.perf_counter() - started)
+            first = False
+        yield text
+    record("generation", time.perf_counter() - started)
@@ -1,39 +1,300 @@
+import asyncio
+import hashlib
+import os
 import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from qdrant_client.http import models
-from app.db.vector_store import get_qdrant_client
-from app.services.embeddings import get_embedding
-from app.services.chunking import split_text
+from app.core.config import settings
+from app.db.vector_store import (
+    BatchUpserter,
+    get_qdrant_client,
+    bump_collection_version,
+    bump_document_version,
+    is_hybrid_collection,
+    DENSE_VECTOR_NAME,
+    SPARSE_VECTOR_NAME,
+)
+from app.db.manifest_store import get_manifest_store
+from app.services.embeddings import get_embeddings
+from app.services.chunking import Chunk, aiter_chunks
+from app.services.extractor import iter_pdf_pages
+from app.services.sparse import document_sparse_vector
 
 COLLECTION_NAME = "docubrain_collection"
 
-async def process_and_save_document(filename: str, text: str):
-    client = get_qdrant_client()
-    
-    # ... (チャンク分割処理はそのまま) ...
-    chunks = split_text(text) # ここは同期関数のままでOK
-    print(f"Processing {len(chunks)} chunks for {filename}...")
-
-    points = []
-    # ... (forループ内のベクトル化処理はそのまま) ...
-    for i, chunk_text in enumerate(chunks):
-        embedding = await get_embedding(chunk_text)
-        point = models.PointStruct(
-            id=str(uuid.uuid4()),
-            vector=embedding,
-            payload={
-                "filename": filename,
-                "text": chunk_text,
-                "chunk_index": i
-            }
-        )
-        points.append(point)
-
-    # 【変更点】 upsert に await をつける
-    if points:
-        await client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=points
-        )
-        print(f"Successfully saved {len(points)} chunks to Qdrant.")
-    
-    return len(points)
\ No newline at end of file
+# 決定的なID (uuid5) を作るための名前空間
+POINT_ID_NAMESPACE = uuid.UUID("6f0c5a8e-3d1b-4f7a-9c2e-8b4d1e0a7f35")
+
+
+def make_document_id(filename: str) -> str:
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, filename))
+
+
+def make_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_point_id(filename: str, chunk_index: int, content_hash: str) -> str:
+    """
+    ファイル名・チャンク位置・内容のハッシュから決定的なポイントIDを作る。
+    同じ内容を再取り込みすると同じIDになるため、重複して保存されない。
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{filename}\x00{chunk_index}\x00{content_hash}"))
+
+
+@dataclass
+class IngestionProgress:
+    """
+    1ドキュメント分の取り込みの進捗
+    """
+    pages: int = 0
+    chunks_embedded: int = 0
+    points_upserted: int = 0
+    chunks_unchanged: int = 0
+    points_deleted: int = 0
+
+
+ProgressCallback = Callable[[IngestionProgress], Awaitable[None]]
+
+
+async def _iter_text_pages(text: str) -> AsyncIterator[tuple[int, str]]:
+    yield 1, text
+
+
+async def _existing_point_ids(point_ids: list[str]) -> set[str]:
+    """
+    指定したIDのうち、実際にQdrantに存在するものを返す
+    """
+    if not point_ids:
+        return set()
+    records = await get_qdrant_client().retrieve(
+        collection_name=COLLECTION_NAME,
+        ids=point_ids,
+        with_payload=False,
+        with_vectors=False
+    )
+    return {str(record.id) for record in records}
+
+
+# 取り込み中のドキュメントごとのロック (document_id -> ロック)。待っている取り込みがなくなったら消す
+_document_locks: dict[str, asyncio.Lock] = {}
+_document_lock_waiters: dict[str, int] = {}
+
+
+@asynccontextmanager
+async def _document_lock(document_id: str):
+    """
+    同じドキュメントの取り込みを1つずつ実行する。
+    同時に走ると両方が同じ前回のマニフェストを読み、後から書いた方のポイントしか記録されないため、
+    もう一方のポイントが削除されずに残ってしまう。
+    """
+    lock = _document_locks.setdefault(document_id, asyncio.Lock())
+    _document_lock_waiters[document_id] = _document_lock_waiters.get(document_id, 0) + 1
+    try:
+        async with lock:
+            yield
+    finally:
+        _document_lock_waiters[document_id] -= 1
+        if not _document_lock_waiters[document_id]:
+            del _document_lock_waiters[document_id]
+            del _document_locks[document_id]
+
+
+async def _save_pages(
+    filename: str,
+    pages: AsyncIterator[tuple[int, str]],
+    on_progress: ProgressCallback | None = None,
+    tags: list[str] | None = None,
+    uploaded_at: str | None = None,
+) -> int:
+    """
+    同じファイル名の取り込みが実行中なら、それが終わるのを待ってから _replace_document を実行する
+    """
+    async with _document_lock(make_document_id(filename)):
+        return await _replace_document(filename, pages, on_progress, tags, uploaded_at)
+
+
+async def _replace_document(
+    filename: str,
+    pages: AsyncIterator[tuple[int, str]],
+    on_progress: ProgressCallback | None = None,
+    tags: list[str] | None = None,
+    uploaded_at: str | None = None,
+) -> int:
+    """
+    ページ単位で届くテキストを順次チャンク分割・ベクトル化し、Qdrantに保存する。
+    ページが届いた分から処理するため、抽出の完了を待たずに埋め込みが始まる。
+    on_progress を渡すと、ページ抽出・埋め込み・保存が進むたびに進捗を通知する。
+
+    同じファイル名で再取り込みした場合は、前回のマニフェストと比較して
+    変更のあったチャンクだけをベクトル化・保存し、なくなったチャンクを削除する。
+    tags / uploaded_at (ISO 8601。省略時は現在時刻) は絞り込み検索用に各ポイントのペイロードへ保存する。
+    """
+    progress = IngestionProgress()
+    document_id = make_document_id(filename)
+    tags = tags or []
+    uploaded_at = uploaded_at or datetime.now(timezone.utc).isoformat()
+    manifest = get_manifest_store()
+    previous_ids = await asyncio.to_thread(manifest.get_point_ids, document_id)
+
+    async def report():
+        if on_progress:
+            await on_progress(progress)
+
+    async def on_batch_saved(saved: int):
+        progress.points_upserted = saved
+        await report()
+
+    # ポイントは固定サイズのバッチで順次送信し、ドキュメント全体を溜め込まない
+    writer = BatchUpserter(COLLECTION_NAME, on_batch_saved=on_batch_saved)
+
+    # 埋め込みエンジンが並列に処理できる量だけ溜めてからまとめてベクトル化する
+    flush_size = settings.EMBEDDING_BATCH_SIZE * settings.EMBEDDING_MAX_CONCURRENCY
+    pending: list[Chunk] = []
+    point_ids: list[str] = []  # このバージョンのドキュメントを構成するポイントID (チャンク順)
+    hybrid = await is_hybrid_collection(COLLECTION_NAME)
+
+    async def flush():
+        if not pending:
+            return
+        chunks = []
+        for chunk in pending:
+            content_hash = make_content_hash(chunk.text)
+            point_id = make_point_id(filename, len(point_ids), content_hash)
+            chunks.append((point_id, len(point_ids), chunk, content_hash))
+            point_ids.append(point_id)
+        pending.clear()
+
+        # 前回と同じIDで、かつQdrantに残っているチャンクは再計算しない
+        unchanged = await _existing_point_ids([c[0] for c in chunks if c[0] in previous_ids])
+        changed = [c for c in chunks if c[0] not in unchanged]
+        progress.chunks_unchanged += len(chunks) - len(changed)
+        if not changed:
+            await report()
+            return
+
+        embeddings = await get_embeddings([c[2].text for c in changed])
+        progress.chunks_embedded += len(embeddings)
+        await report()
+
+        for (point_id, chunk_index, chunk, content_hash), embedding in zip(changed, embeddings):
+            vector = embedding
+            if hybrid:
+                vector = {
+                    DENSE_VECTOR_NAME: embedding,
+                    SPARSE_VECTOR_NAME: document_sparse_vector(chunk.text)
+                }
+            point = models.PointStruct(
+                id=point_id,
+                vector=vector,
+                payload={
+                    "filename": filename,
+                    "document_id": document_id,
+                    "text": chunk.text,
+                    "chunk_index": chunk_index,
+                    "page": chunk.page,
+                    "start": chunk.start,
+                    "end": chunk.end,
+                    "content_hash": content_hash,
+                    "tags": tags,
+                    "uploaded_at": uploaded_at
+                }
+            )
+            await writer.add(point)
+
+    async def counted_pages():
+        async for page in pages:
+            progress.pages += 1
+            await report()
+            yield page
+
+    try:
+        async for chunk in aiter_chunks(counted_pages()):
+            pending.append(chunk)
+            if len(pending) >= flush_size:
+                await flush()
+        await flush()
+        saved = await writer.close()
+    except BaseException:
+        await writer.abort()
+        if writer.saved:
+            # 途中まで書き込んだ分も、検索結果キャッシュと回答キャッシュから外す
+            bump_document_version(COLLECTION_NAME, document_id)
+        raise
+
+    stale_ids = list(previous_ids - set(point_ids))
+    try:
+        # 再計算しなかったチャンクも、タグとアップロード日時は今回の値に揃える
+        if progress.chunks_unchanged:
+            await get_qdrant_client().set_payload(
+                collection_name=COLLECTION_NAME,
+                payload={"tags": tags, "uploaded_at": uploaded_at},
+                points=models.Filter(must=[
+                    models.FieldCondition(key="document_id", match=models.MatchValue(value=document_id))
+                ]),
+                wait=True
+            )
+
+        # 新しいバージョンに存在しないチャンクを削除する
+        if stale_ids:
+            await get_qdrant_client().delete(
+                collection_name=COLLECTION_NAME,
+                points_selector=models.PointIdsList(points=stale_ids)
+            )
+            progress.points_deleted = len(stale_ids)
+            await report()
+        await asyncio.to_thread(manifest.replace, document_id, filename, point_ids)
+    finally:
+        # キャッシュの無効化はバッチごとではなく、ドキュメントの取り込みが終わったときに1回だけ行う
+        if saved or stale_ids:
+            bump_document_version(COLLECTION_NAME, document_id)
+        elif progress.chunks_unchanged:
+            # 内容は同じでタグ・日時だけが変わった: 絞り込み検索の結果は変わるが、回答は作り直さなくてよい
+            bump_collection_version(COLLECTION_NAME)
+
+    print(
+        f"Successfully saved {filename} to Qdrant: {len(point_ids)} chunks "
+        f"({saved} upserted, {progress.chunks_unchanged} unchanged, {len(stale_ids)} deleted)."
+    )
+    return len(point_ids)
+
+
+async def process_and_save_document(
+    filename: str,
+    text: str,
+    on_progress: ProgressCallback | None = None,
+    tags: list[str] | None = None,
+    uploaded_at: str | None = None,
+):
+    """
+    抽出済みのテキストをチャンク分割・ベクトル化して保存する
+    """
+    print(f"Processing {filename}...")
+    return await _save_pages(filename, _iter_text_pages(text), on_progress, tags=tags, uploaded_at=uploaded_at)
+
+
+async def process_and_save_pdf(
+    filename: str,
+    path: str,
+    on_progress: ProgressCallback | None = None,
+    tags: list[str] | None = None,
+    uploaded_at: str | None = None,
+):
+    """
+    一時保存されたPDFをページ単位で抽出しながら保存する。処理後に一時ファイルを削除する。
+    """
+    print(f"Processing {filename} (streaming extraction)...")
+    try:
+        saved = await _save_pages(filename, iter_pdf_pages(path), on_progress, tags=tags, uploaded_at=uploaded_at)
+    except asyncio.CancelledError:
+        # シャットダウンで中断された場合は、再開できるよう一時ファイルを残す
+        raise
+    except Exception as e:
+        print(f"Failed to ingest {filename}: {e}")
+        os.remove(path)
+        raise
+    os.remove(path)
+    return saved
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from app.core.config import settings
+from app.core.tracing import format_summary, span, start_trace
+from app.db.job_store import JobStore, get_job_store, JOB_COMPLETED, JOB_FAILED
+from app.services.ingestion import IngestionProgress, process_and_save_pdf
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionJobQueue:
+    """
+    SQLite に永続化された取り込みジョブを、固定数のワーカーで順に処理するキュー。
+
+    - 同時に処理するドキュメント数は num_workers で制限する
+    - ジョブの状態と進捗 (ページ数・埋め込み済みチャンク数・保存済みポイント数) はストアに記録する
+    - 起動時に、前回実行中だったジョブを待機中に戻して再開する
+    """
+
+    def __init__(self, store: JobStore, num_workers: int = settings.INGESTION_WORKERS):
+        self.store = store
+        self.num_workers = max(1, num_workers)
+        self._workers: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    async def start(self):
+        requeued = await asyncio.to_thread(self.store.requeue_running)
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted ingestion job(s)")
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"ingestion-worker-{i}")
+            for i in range(self.num_workers)
+        ]
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def enqueue(
+        self, filename: str, path: str, batch_id: str | None = None, tags: list[str] | None = None
+    ) -> dict:
+        """
+        一時保存済みのPDFをジョブとして登録し、ジョブ情報を返す
+        """
+        job = await asyncio.to_thread(self.store.create, filename, path, batch_id, tags)
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> dict | None:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def list_batch(self, batch_id: str) -> list[dict]:
+        return await asyncio.to_thread(self.store.list_batch, batch_id)
+
+    async def add_rejections(self, batch_id: str, rejections: list[tuple[str, str | None]]):
+        if rejections:
+            await asyncio.to_thread(self.store.add_rejections, batch_id, rejections)
+
+    async def list_rejections(self, batch_id: str) -> list[dict]:
+        return await asyncio.to_thread(self.store.list_rejections, batch_id)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await asyncio.to_thread(self.store.claim_next)
+            if job is None:
+                # 新しいジョブの通知を待つ (取りこぼし防止のため定期的にも確認する)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(worker_id, job)
+
+    async def _run(self, worker_id: int, job: dict):
+        job_id = job["id"]
+        logger.info(f"[worker {worker_id}] Ingesting {job['filename']} (job {job_id})")
+
+        async def on_progress(progress: IngestionProgress):
+            await asyncio.to_thread(
+                self.store.update_progress,
+                job_id,
+                pages=progress.pages,
+                chunks_embedded=progress.chunks_embedded,
+                points_upserted=progress.points_upserted,
+            )
+
+        try:
+            # アップロード日時 (ジョブの登録日時) とタグは、絞り込み検索用にペイロードへ保存される
+            # ジョブごとにトレースを分け、各段階の所要時間をまとめてログに出す
+            trace = start_trace()
+            with span("ingestion"):
+                await process_and_save_pdf(
+                    job["filename"],
+                    job["path"],
+                    on_progress=on_progress,
+                    tags=job["tags"],
+                    uploaded_at=job["created_at"]
+                )
+            logger.info(f"[worker {worker_id}] Job {job_id} stage timings: {format_summary(trace)}")
+        except asyncio.CancelledError:
+            # シャットダウン時はジョブを実行中のまま残し、次回起動時に再開する
+            raise
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}", exc_info=True)
+            await asyncio.to_thread(self.store.finish, job_id, JOB_FAILED, str(e))
+        else:
+            await asyncio.to_thread(self.store.finish, job_id, JOB_COMPLETED)
+            logger.info(f"[worker {worker_id}] Completed job {job_id}")
+
+
+# グローバル変数
+_queue = None
+
+def get_job_queue() -> IngestionJobQueue:
+    """
+    取り込みジョブキューを返す (Singleton)
+    """
+    global _queue
+    if _queue is None:
+        _queue = IngestionJobQueue(get_job_store())
+    return _queue
@@ -1,21 +1,207 @@
+import asyncio
+import json
 import sys
 import os
 import traceback
-from contextlib import AsyncExitStack
+from collections import OrderedDict
+from collections.abc import Callable
 from mcp import ClientSession, StdioServerParameters
+from mcp.types import TextContent
 from mcp.client.stdio import stdio_client
+from app.core.config import settings
+from app.core.tracing import span
+
+# 再起動の待ち時間の上限 (秒)
+MAX_RESPAWN_DELAY = 30.0
+
+
+def is_pure_tool(tool) -> bool:
+    """
+    ツールが純粋 (副作用がなく、同じ引数なら同じ結果) と宣言されているか。
+    サーバー側で ToolAnnotations(readOnlyHint=True, idempotentHint=True) を付けたものが該当する。
+    """
+    annotations = tool.annotations
+    return bool(annotations and annotations.readOnlyHint and annotations.idempotentHint)
+
+
+class MCPSession:
+    """
+    MCPサーバーのサブプロセス1つと、そのセッション。
+
+    stdio_client / ClientSession は開始したタスクと同じタスクで終了する必要があるため、
+    接続は専用の常駐タスク (_run) が持ち続ける。ツール呼び出しは他のタスクから session を使って行う。
+    常駐タスクは定期的に ping で死活監視し、プロセスが落ちたり応答しなくなったら起動し直す。
+    呼び出しが時間切れになった場合は、そのセッションを振り分け対象から外し、すぐに ping で確認する。
+    """
+
+    def __init__(
+        self,
+        index: int,
+        server_params: StdioServerParameters,
+        on_connect: Callable[[], None] | None = None,
+    ):
+        self.index = index
+        self.server_params = server_params
+        self.on_connect = on_connect  # (再)接続のたびに呼ばれる
+        self.session: ClientSession | None = None
+        self.in_flight = 0  # 実行中の呼び出し数 (ディスパッチの偏りを避けるために使う)
+        self.calls = 0
+        self.failures = 0
+        self.restarts = 0  # 接続が切れた後に再接続できた回数
+        self.suspect = False  # 呼び出しが時間切れになり、ping で確認するまで使わない
+        self.ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._check_now = asyncio.Event()  # 次の間隔を待たずに死活確認する
+        self._task: asyncio.Task | None = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.session is not None and not self.suspect
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name=f"mcp-session-{self.index}")
+
+    async def _run(self):
+        delay = settings.MCP_RESPAWN_DELAY
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                async with stdio_client(self.server_params) as (read, write):
+                    async with ClientSession(read, write) as session:
+                        await session.initialize()
+                        self.session = session
+                        self.suspect = False
+                        self.ready.set()
+                        delay = settings.MCP_RESPAWN_DELAY
+                        if connected_before:
+                            self.restarts += 1
+                        connected_before = True
+                        if self.on_connect:
+                            self.on_connect()
+                        print(f"✅ Connected to MCP Server (Internal) [session {self.index}]")
+                        await self._monitor(session)
+            except Exception:
+                print(f"❌ [ERROR] MCP session {self.index} failed:")
+                traceback.print_exc()
+            finally:
+                self.session = None
+                self.ready.clear()
+
+            if self._stop.is_set():
+                break
+            # 落ちたプロセスを起動し直す (失敗が続く場合は間隔を延ばす)
+            print(f"🔄 Restarting MCP session {self.index} in {delay:.1f}s")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, MAX_RESPAWN_DELAY)
+
+    async def _monitor(self, session: ClientSession):
+        """
+        停止が要求されるまで、一定間隔で (呼び出しが時間切れになった場合はすぐに) ping を送る。
+        応答がなければ例外で抜けて再起動させる。
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._check_now.wait(), timeout=settings.MCP_HEALTH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._check_now.clear()
+            if self._stop.is_set():
+                return
+            await asyncio.wait_for(session.send_ping(), timeout=settings.MCP_CALL_TIMEOUT)
+            self.suspect = False
+
+    async def request(self, method: str, *args, timeout: float | None = None):
+        """
+        セッションのメソッド (list_tools / call_tool) を制限時間付きで呼ぶ
+        """
+        session = self.session
+        if session is None:
+            raise RuntimeError("MCP session is not connected")
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            with span(f"mcp:{method}"):
+                return await asyncio.wait_for(
+                    getattr(session, method)(*args),
+                    timeout=timeout or settings.MCP_CALL_TIMEOUT
+                )
+        except asyncio.TimeoutError:
+            self.failures += 1
+            # プロセスが固まっている可能性があるため、確認できるまで振り分け対象から外す
+            self.suspect = True
+            self._check_now.set()
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def stop(self):
+        self._stop.set()
+        self._check_now.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=settings.MCP_CALL_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "index": self.index,
+            "healthy": self.healthy,
+            "suspect": self.suspect,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "failures": self.failures,
+            "restarts": self.restarts,
+        }
+
 
 class MCPClient:
-    def __init__(self):
-        self.session = None
-        self.exit_stack = AsyncExitStack()
+    """
+    MCPサーバー(server.py)のサブプロセスを pool_size 個起動し、セッションのプールとして使うクライアント。
+
+    - 呼び出しは、接続中のセッションのうち実行中の呼び出しが最も少ないものに振り分ける
+    - 呼び出しごとに制限時間 (MCP_CALL_TIMEOUT) を設ける
+    - 各セッションは死活監視され、プロセスが落ちると自動で起動し直す
+    - ツール一覧はキャッシュし、セッションが (再)接続したら取り直す
+    - 純粋なツールの結果は (ツール名, 引数) ごとにキャッシュする
+    - MCP_INPROCESS_TOOLS に含まれる純粋なツールは、サブプロセスを経由せずこのプロセス内で実行する
+    """
+
+    def __init__(self, pool_size: int = settings.MCP_POOL_SIZE, cache_size: int = settings.MCP_TOOL_CACHE_SIZE):
+        self.pool_size = max(1, pool_size)
+        self.sessions: list[MCPSession] = []
+        self.cache_size = cache_size
+        self._tools = None  # list_tools の結果のキャッシュ
+        self._pure_tools: set[str] = set()
+        self._results: OrderedDict[tuple[str, str], list] = OrderedDict()  # 純粋なツールの結果 (LRU)
+        self._local_server = None
+        self._local_tools: set[str] | None = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.inprocess_calls = 0
+        self.inprocess_failures = 0
+
+    def _invalidate(self):
+        """
+        サーバーが変わった可能性があるので、ツール一覧と結果のキャッシュを捨てる
+        """
+        self._tools = None
+        self._pure_tools = set()
+        self._results.clear()
 
     async def connect(self):
         """MCPサーバー(server.py)をサブプロセスとして起動し接続する"""
-        
+
         # 【修正】Dockerコンテナ内の絶対パスを直接指定 (これが一番確実！)
-        server_path = "/app/app/mcp/server.py"
-        
+        server_path = settings.MCP_SERVER_PATH
+
         print(f"🔧 [Target Path] {server_path}")
 
         # 存在確認
@@ -36,36 +222,138 @@ class MCPClient:
             env=dict(os.environ)
         )
 
-        try:
-            stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-            self.read, self.write = stdio_transport
-            
-            self.session = await self.exit_stack.enter_async_context(ClientSession(self.read, self.write))
-            
-            await self.session.initialize()
-            print("✅ Connected to MCP Server (Internal)")
-            
-        except Exception as e:
+        self.sessions = [MCPSession(i, server_params, on_connect=self._invalidate) for i in range(self.pool_size)]
+        for session in self.sessions:
+            session.start()
+
+        # 少なくとも1つのセッションが使えるようになるまで待つ (残りは裏で接続を続ける)
+        waiters = [asyncio.create_task(session.ready.wait()) for session in self.sessions]
+        done, pending = await asyncio.wait(
+            waiters, timeout=settings.MCP_CONNECT_TIMEOUT, return_when=asyncio.FIRST_COMPLETED
+        )
+        for waiter in pending:
+            waiter.cancel()
+        if not done:
             print(f"❌ [ERROR] Failed to connect/initialize MCP:")
-            traceback.print_exc()
             await self.close()
-            raise e
+            raise RuntimeError("Timed out connecting to MCP Server")
 
-    async def list_tools(self):
-        if not self.session:
+    def _pick(self) -> MCPSession:
+        """
+        接続中のセッションのうち、実行中の呼び出しが最も少ないものを返す
+        """
+        healthy = [session for session in self.sessions if session.healthy]
+        if not healthy:
             raise RuntimeError("MCP session is not connected")
-        response = await self.session.list_tools()
-        return response.tools
+        return min(healthy, key=lambda session: session.in_flight)
 
-    async def call_tool(self, name: str, arguments: dict):
-        if not self.session:
-            raise RuntimeError("MCP session is not connected")
-        result = await self.session.call_tool(name, arguments)
-        return result.content
+    async def list_tools(self):
+        if self._tools is None:
+            response = await self._pick().request("list_tools")
+            self._tools = response.tools
+            self._pure_tools = {tool.name for tool in self._tools if is_pure_tool(tool)}
+        return self._tools
+
+    async def _get_local_tools(self) -> set[str]:
+        """
+        このプロセス内で実行してよいツール名 (MCP_INPROCESS_TOOLS のうち純粋と宣言されたもの)
+        """
+        if self._local_tools is None:
+            self._local_tools = set()
+            if settings.MCP_INPROCESS_TOOLS:
+                from app.mcp.server import mcp as local_server
+
+                self._local_server = local_server
+                self._local_tools = {
+                    tool.name for tool in await local_server.list_tools()
+                    if tool.name in settings.MCP_INPROCESS_TOOLS and is_pure_tool(tool)
+                }
+        return self._local_tools
+
+    async def _is_pure(self, name: str, local_tools: set[str]) -> bool:
+        if name in local_tools:
+            return True
+        try:
+            await self.list_tools()
+        except Exception:
+            return False
+        return name in self._pure_tools
+
+    async def _call_local(self, name: str, arguments: dict, timeout: float | None = None) -> tuple[list, bool]:
+        """
+        ツールをこのプロセス内で実行し、(content, エラーかどうか) を返す。
+        サブプロセス経由の場合と同じく、時間切れは例外にし、ツールの例外 (引数の検証エラーなど) は
+        isError=True の結果と同じ形 (エラーメッセージのテキスト) にして返す。
+        """
+        self.inprocess_calls += 1
+        try:
+            with span("mcp:call_tool_inprocess"):
+                result = await asyncio.wait_for(
+                    self._local_server.call_tool(name, arguments),
+                    timeout=timeout or settings.MCP_CALL_TIMEOUT
+                )
+        except asyncio.TimeoutError:
+            self.inprocess_failures += 1
+            raise
+        except Exception as e:
+            self.inprocess_failures += 1
+            return [TextContent(type="text", text=str(e))], True
+        # 構造化出力を持つツールは (content, structured) のタプルを返す
+        return list(result[0] if isinstance(result, tuple) else result), False
+
+    async def call_tool(self, name: str, arguments: dict, timeout: float | None = None):
+        local_tools = await self._get_local_tools()
+        pure = self.cache_size > 0 and await self._is_pure(name, local_tools)
+        key = (name, json.dumps(arguments, sort_keys=True, default=str))
+        if pure:
+            cached = self._results.get(key)
+            if cached is not None:
+                self._results.move_to_end(key)
+                self.cache_hits += 1
+                return list(cached)
+            self.cache_misses += 1
+
+        if name in local_tools:
+            content, is_error = await self._call_local(name, arguments, timeout=timeout)
+        else:
+            result = await self._pick().request("call_tool", name, arguments, timeout=timeout)
+            content, is_error = result.content, result.isError
+        # エラー結果はキャッシュしない
+        pure = pure and not is_error
+
+        if pure:
+            self._results[key] = list(content)
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return content
+
+    def stats(self) -> dict:
+        """
+        プールの状態 (接続中のセッション数・実行中の呼び出し数など) を返す
+        """
+        sessions = [session.stats() for session in self.sessions]
+        return {
+            "pool_size": self.pool_size,
+            "healthy": sum(1 for s in sessions if s["healthy"]),
+            "in_flight": sum(s["in_flight"] for s in sessions),
+            "calls": sum(s["calls"] for s in sessions),
+            "failures": sum(s["failures"] for s in sessions),
+            "restarts": sum(s["restarts"] for s in sessions),
+            "tool_cache": {
+                "entries": len(self._results),
+                "max_entries": self.cache_size,
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+            },
+            "inprocess_calls": self.inprocess_calls,
+            "inprocess_failures": self.inprocess_failures,
+            "sessions": sessions,
+        }
 
     async def close(self):
-        if self.exit_stack:
-            await self.exit_stack.aclose()
+        if self.sessions:
+            await asyncio.gather(*(session.stop() for session in self.sessions))
+            self.sessions = []
             print("🛑 MCP Client closed")
 
-mcp_client = MCPClient()
\ No newline at end of file
+mcp_client = MCPClient()
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from app.services.embedding_cache import normalize_text
+
+
+def make_query_key(query: str, limit: int, **options) -> str:
+    """
+    正規化したクエリ・件数・その他の検索条件からキャッシュキーを作る
+    """
+    return json.dumps(
+        {"query": normalize_text(query).lower(), "limit": limit, **options},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+
+
+class QueryResultCache:
+    """
+    検索結果の TTL + LRU キャッシュ。
+
+    エントリは保存時のコレクションバージョンを持ち、取り込みでバージョンが進むと
+    そのエントリは無効になる (古い検索結果を返さない)。
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (保存時刻, コレクションバージョン, 結果, 計算にかかった秒数)
+        self._entries: OrderedDict[str, tuple[float, int, list, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key: str, version: int) -> list | None:
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, stored_version, results, elapsed = entry
+            if stored_version != version or time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += elapsed
+            return list(results)
+
+    def put(self, key: str, version: int, results: list, elapsed: float):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), version, list(results), elapsed)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
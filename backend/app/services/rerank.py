@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.core.config import settings
+from app.core.tracing import span
+from app.schemas.search import SearchResultItem
+
+logger = logging.getLogger(__name__)
+
+# モデルの推論はCPUを占有するため、1本の専用スレッドで直列に実行する
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+_model = None
+_model_lock = threading.Lock()
+_load_failed = False
+
+
+def _get_model():
+    """
+    CrossEncoder を遅延ロードする。依存パッケージやモデルがなければ None。
+    """
+    global _model, _load_failed
+    with _model_lock:
+        if _model is None and not _load_failed:
+            try:
+                from sentence_transformers import CrossEncoder
+                _model = CrossEncoder(settings.RERANK_MODEL, device="cpu")
+                logger.info(f"Loaded rerank model: {settings.RERANK_MODEL}")
+            except Exception as e:
+                _load_failed = True
+                logger.warning(f"Rerank model unavailable, keeping original order: {e}")
+        return _model
+
+
+def is_available() -> bool:
+    """
+    モデルの読み込みに失敗していないか (まだ読み込んでいない場合は True)。
+    読み込みの失敗 (依存パッケージやモデルがない) は再試行しても直らないため、
+    検索側はこれが False なら再ランキングを無効として扱い、候補の多めの取得も省く。
+    """
+    return not _load_failed
+
+
+def _score(query: str, texts: list[str]) -> list[float] | None:
+    model = _get_model()
+    if model is None:
+        return None
+    # (クエリ, 候補) のペアをバッチでまとめて推論する
+    scores = model.predict(
+        [(query, text) for text in texts],
+        batch_size=settings.RERANK_BATCH_SIZE,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return scores.tolist()
+
+
+def warmup():
+    """
+    起動時にモデルを読み込んでおき、最初の検索でロード時間を払わないようにする
+    """
+    if settings.RERANK_ENABLED:
+        _executor.submit(_get_model)
+
+
+async def rerank(
+    query: str, candidates: list[SearchResultItem], top_k: int
+) -> tuple[list[SearchResultItem], bool]:
+    """
+    候補をクロスエンコーダのスコアで並べ替え、(上位 top_k 件, 再ランキングできたか) を返す。
+    時間内に終わらない・エラーの場合は元の順位のまま top_k 件を返し、False を返す
+    (呼び出し側は、再ランキングされていない結果をキャッシュしないこと)。
+    モデルが使えない場合は再ランキングが無効なのと同じなので、元の順位のまま True を返す。
+    """
+    if len(candidates) <= 1:
+        return candidates[:top_k], True
+
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, _score, query, [c.text for c in candidates])
+    try:
+        with span("rerank"):
+            scores = await asyncio.wait_for(future, timeout=settings.RERANK_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Rerank exceeded {settings.RERANK_TIMEOUT}s budget, keeping original order")
+        return candidates[:top_k], False
+    except Exception as e:
+        logger.warning(f"Rerank failed, keeping original order: {e}")
+        return candidates[:top_k], False
+
+    if scores is None:
+        return candidates[:top_k], True
+
+    ranked = sorted(zip(candidates, scores), key=lambda pair: pair[1], reverse=True)
+    logger.info(f"Reranked {len(candidates)} candidates in {time.perf_counter() - started:.3f}s")
+    return [
+        candidate.model_copy(update={"score": float(score)})
+        for candidate, score in ranked[:top_k]
+    ], True
@@ -1,17 +1,132 @@
+import asyncio
+import time
 import qdrant_client
-from app.db.vector_store import get_qdrant_client
-from app.services.embeddings import get_embedding
-from app.schemas.search import SearchResultItem
+from qdrant_client import models
+from app.core.config import settings
+from app.core.tracing import record, span
+from app.db.vector_store import (
+    get_qdrant_client,
+    get_collection_version,
+    is_hybrid_collection,
+    build_search_params,
+    DENSE_VECTOR_NAME,
+    SPARSE_VECTOR_NAME,
+)
+from app.services.embeddings import get_embedding, get_embeddings
+from app.services.query_cache import QueryResultCache, make_query_key
+from app.services.sparse import query_sparse_vector
+from app.services.rerank import rerank as rerank_results, is_available as rerank_available
+from app.schemas.search import SearchFilters, SearchRequest, SearchResultItem
 
 COLLECTION_NAME = "docubrain_collection"
 
-async def search_relevant_documents(query: str, limit: int = 5) -> list[SearchResultItem]:
+# 検索クエリの埋め込みの用途。ドキュメント側 (retrieval_document) と対になる非対称検索用のベクトルを使う
+QUERY_TASK_TYPE = "retrieval_query"
+
+# 検索結果キャッシュ (同じ質問の再検索を省く)
+query_cache = QueryResultCache(settings.SEARCH_CACHE_SIZE, settings.SEARCH_CACHE_TTL)
+
+def build_search_filter(filters: SearchFilters | None) -> models.Filter | None:
+    """
+    絞り込み条件を Qdrant のフィルタに変換する。条件がなければ None。
+    各フィールドにはペイロードインデックスがあるため (init_collection で作成)、
+    候補を多めに取ってから Python 側で絞り込む必要はない。
+    """
+    if filters is None:
+        return None
+    conditions = []
+    for key, values in (
+        ("filename", filters.filenames),
+        ("document_id", filters.document_ids),
+        ("tags", filters.tags),
+    ):
+        if values:
+            conditions.append(models.FieldCondition(key=key, match=models.MatchAny(any=values)))
+    if filters.uploaded_after or filters.uploaded_before:
+        conditions.append(models.FieldCondition(
+            key="uploaded_at",
+            range=models.DatetimeRange(gte=filters.uploaded_after, lte=filters.uploaded_before)
+        ))
+    return models.Filter(must=conditions) if conditions else None
+
+def _build_query(
+    query: str,
+    query_vector: list[float],
+    limit: int,
+    hybrid: bool,
+    query_filter: models.Filter | None = None,
+    hnsw_ef: int | None = None,
+    exact: bool | None = None,
+) -> dict:
+    """
+    query_points に渡す検索条件を組み立てる。
+
+    ハイブリッド構成のコレクション (hybrid) では、密ベクトル検索と BM25 疎ベクトル検索を
+    prefetch として1リクエストで同時に実行し、Reciprocal Rank Fusion で統合する。
+    HNSW / 量子化の検索パラメータは密ベクトル検索に適用する。
+    フィルタは各 prefetch にも適用し、統合前の候補の段階で絞り込む。
+    """
+    search_params = build_search_params(hnsw_ef=hnsw_ef, exact=exact)
+    if not hybrid:
+        return {"query": query_vector, "query_filter": query_filter, "search_params": search_params}
+
+    candidates = max(limit * 4, settings.HYBRID_PREFETCH_LIMIT)
+    prefetch = [
+        models.Prefetch(query=query_vector, using=DENSE_VECTOR_NAME, limit=candidates,
+                        filter=query_filter, params=search_params)
+    ]
+    sparse_vector = query_sparse_vector(query)
+    if sparse_vector.indices:
+        prefetch.append(models.Prefetch(query=sparse_vector, using=SPARSE_VECTOR_NAME, limit=candidates, filter=query_filter))
+    return {
+        "prefetch": prefetch,
+        "query": models.FusionQuery(fusion=models.Fusion.RRF),
+        "query_filter": query_filter,
+    }
+
+def _make_cache_key(query: str, limit: int, filters: SearchFilters | None, **options) -> str:
+    return make_query_key(
+        query, limit,
+        filters=filters.model_dump(mode="json", exclude_none=True) if filters else None,
+        **options
+    )
+
+def to_search_result(payload: dict, score: float) -> SearchResultItem:
+    """
+    ポイントのペイロードを検索結果の1件に変換する
+    """
+    return SearchResultItem(
+        text=payload.get("text", ""),
+        filename=payload.get("filename", "unknown"),
+        score=score,
+        document_id=payload.get("document_id"),
+        chunk_index=payload.get("chunk_index"),
+        page=payload.get("page"),
+        start=payload.get("start"),
+        end=payload.get("end")
+    )
+
+def _to_results(points) -> list[SearchResultItem]:
+    return [to_search_result(hit.payload, hit.score) for hit in points]
+
+async def search_relevant_documents(
+    query: str,
+    limit: int = 5,
+    filters: SearchFilters | None = None,
+    rerank: bool | None = None,
+    hnsw_ef: int | None = None,
+    exact: bool | None = None,
+) -> list[SearchResultItem]:
     """
     クエリに関連するドキュメントを検索
     
     Args:
         query: 検索クエリ文字列
         limit: 取得する結果の最大数
+        filters: ファイル名・ドキュメントID・タグ・アップロード日時による絞り込み条件
+        rerank: クロスエンコーダで再ランキングするか (None なら RERANK_ENABLED に従う)
+        hnsw_ef: HNSW の探索幅 (None なら QDRANT_HNSW_EF)。大きいほど正確で遅い
+        exact: True なら HNSW を使わず全件比較する (None なら QDRANT_EXACT_SEARCH)
         
     Returns:
         SearchResultItemのリスト
@@ -19,27 +134,139 @@ async def search_relevant_documents(query: str, limit: int = 5) -> list[SearchRe
     Raises:
         Exception: Qdrant検索または埋め込み生成時のエラー
     """
+    # 0. キャッシュ確認 (取り込みでコレクションが更新されていれば無効)
+    # モデルを読み込めなかった場合は、再ランキングが無効なのと同じに扱う
+    use_rerank = (settings.RERANK_ENABLED if rerank is None else rerank) and rerank_available()
+    cache_key = _make_cache_key(query, limit, filters, rerank=use_rerank, hnsw_ef=hnsw_ef, exact=exact)
+    version = get_collection_version(COLLECTION_NAME)
+    cached = query_cache.get(cache_key, version)
+    if cached is not None:
+        return cached
+
+    started = time.perf_counter()
     client = get_qdrant_client()
     
     # 1. クエリをベクトル化
-    query_vector = await get_embedding(query)
+    query_vector = await get_embedding(query, task_type=QUERY_TASK_TYPE)
     
     # 2. Qdrantで類似検索を実行 (AsyncQdrantClient は query_points を使用)
-    response = await client.query_points(
-        collection_name=COLLECTION_NAME,
-        query=query_vector,
-        limit=limit,
-        with_payload=True
-    )
+    # 再ランキングする場合は候補を多めに取得する
+    fetch_limit = max(limit, settings.RERANK_CANDIDATES) if use_rerank else limit
+    hybrid = await is_hybrid_collection(COLLECTION_NAME)
+    with span("qdrant_query"):
+        response = await client.query_points(
+            collection_name=COLLECTION_NAME,
+            limit=fetch_limit,
+            with_payload=True,
+            **_build_query(
+                query, query_vector, fetch_limit, hybrid,
+                query_filter=build_search_filter(filters), hnsw_ef=hnsw_ef, exact=exact
+            )
+        )
     
     # 3. 結果整形
-    results = [
-        SearchResultItem(
-            text=hit.payload.get("text", ""),
-            filename=hit.payload.get("filename", "unknown"),
-            score=hit.score
-        )
-        for hit in response.points
+    results = _to_results(response.points)
+
+    # 4. 再ランキング (時間切れ・失敗時は元の順位のまま)
+    reranked = True
+    if use_rerank:
+        results, reranked = await rerank_results(query, results, top_k=limit)
+
+    elapsed = time.perf_counter() - started
+    record("search", elapsed)
+    # 再ランキングできなかった結果は一時的な劣化なので、キャッシュせず次回に再計算させる
+    if reranked:
+        query_cache.put(cache_key, version, results, elapsed)
+    return results
+
+async def search_relevant_documents_batch(
+    requests: list[SearchRequest],
+    rerank: bool | None = None,
+) -> list[list[SearchResultItem]]:
+    """
+    複数のクエリをまとめて検索する。結果は requests と同じ順序で返す。
+
+    キャッシュにないクエリだけを、1回の埋め込み呼び出しでまとめてベクトル化し、
+    Qdrant の query_batch_points で1往復で検索する。同じ条件のクエリは1回だけ検索する。
+    エージェントが複数の小さな質問に分けて調べる場合などに使う。
+
+    Args:
+        requests: 検索条件 (query / limit / filters / hnsw_ef / exact) のリスト
+        rerank: クロスエンコーダで再ランキングするか (None なら RERANK_ENABLED に従う)
+
+    Returns:
+        クエリごとの SearchResultItem のリスト
+    """
+    if not requests:
+        return []
+
+    # モデルを読み込めなかった場合は、再ランキングが無効なのと同じに扱う
+    use_rerank = (settings.RERANK_ENABLED if rerank is None else rerank) and rerank_available()
+    version = get_collection_version(COLLECTION_NAME)
+    keys = [
+        _make_cache_key(r.query, r.limit, r.filters, rerank=use_rerank, hnsw_ef=r.hnsw_ef, exact=r.exact)
+        for r in requests
     ]
-    
-    return results
\ No newline at end of file
+
+    # 0. キャッシュ確認。未ヒットのものは条件ごとに1つにまとめる
+    results: dict[str, list[SearchResultItem]] = {}
+    missing: dict[str, SearchRequest] = {}
+    for key, request in zip(keys, requests):
+        if key in results or key in missing:
+            continue
+        cached = query_cache.get(key, version)
+        if cached is not None:
+            results[key] = cached
+        else:
+            missing[key] = request
+
+    if missing:
+        started = time.perf_counter()
+        pending = list(missing.items())
+
+        # 1. 未ヒットのクエリをまとめてベクトル化
+        query_vectors = await get_embeddings([r.query for _, r in pending], task_type=QUERY_TASK_TYPE)
+
+        # 2. まとめて検索 (1往復)
+        hybrid = await is_hybrid_collection(COLLECTION_NAME)
+        query_requests = []
+        for (_, request), query_vector in zip(pending, query_vectors):
+            fetch_limit = max(request.limit, settings.RERANK_CANDIDATES) if use_rerank else request.limit
+            query = _build_query(
+                request.query, query_vector, fetch_limit, hybrid,
+                query_filter=build_search_filter(request.filters),
+                hnsw_ef=request.hnsw_ef, exact=request.exact
+            )
+            query_requests.append(models.QueryRequest(
+                query=query["query"],
+                prefetch=query.get("prefetch"),
+                filter=query.get("query_filter"),
+                params=query.get("search_params"),
+                limit=fetch_limit,
+                with_payload=True
+            ))
+        with span("qdrant_query_batch"):
+            responses = await get_qdrant_client().query_batch_points(
+                collection_name=COLLECTION_NAME,
+                requests=query_requests
+            )
+
+        # 3. 結果整形と再ランキング (再ランキングはクエリごとに並行して行う)
+        batch_results = [_to_results(response.points) for response in responses]
+        reranked = [True] * len(batch_results)
+        if use_rerank:
+            ranked = await asyncio.gather(*(
+                rerank_results(request.query, items, top_k=request.limit)
+                for (_, request), items in zip(pending, batch_results)
+            ))
+            batch_results = [items for items, _ in ranked]
+            reranked = [ok for _, ok in ranked]
+
+        record("search_batch", time.perf_counter() - started)
+        elapsed = (time.perf_counter() - started) / len(pending)
+        for (key, _), items, ok in zip(pending, batch_results, reranked):
+            if ok:
+                query_cache.put(key, version, items, elapsed)
+            results[key] = items
+
+    return [results[key] for key in keys]
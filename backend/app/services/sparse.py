@@ -0,0 +1,57 @@
+import re
+import unicodedata
+import zlib
+from collections import Counter
+from qdrant_client import models
+from app.core.config import settings
+
+# 英数字の単語 (c++, c#, node.js などの技術用語を1語として扱う)
+_WORD = re.compile(r"[a-z0-9][a-z0-9+#._-]*[a-z0-9+#]|[a-z0-9]")
+# 日本語 (ひらがな・カタカナ・漢字) の連続
+_CJK_RUN = re.compile(r"[ぁ-ゖァ-ヺー一-鿿々〆]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    形態素解析器を使わないローカルのトークナイザ。
+
+    - NFKC 正規化と小文字化で全角/半角・大文字/小文字の揺れを吸収する
+    - 英数字は単語単位
+    - 日本語は文字 bi-gram (1文字だけの語はそのまま)
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = _WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _token_index(token: str) -> int:
+    # 語彙を持たずに済むよう、トークンをハッシュで疎ベクトルの次元に割り当てる
+    return zlib.crc32(token.encode("utf-8")) & 0x7FFFFFFF
+
+
+def _to_sparse(weights: dict[int, float]) -> models.SparseVector:
+    indices = sorted(weights)
+    return models.SparseVector(indices=indices, values=[weights[i] for i in indices])
+
+
+def document_sparse_vector(text: str) -> models.SparseVector:
+    """
+    チャンクの BM25 用疎ベクトル (TF の飽和と文書長の正規化のみ。IDF は Qdrant が掛ける)
+    """
+    counts = Counter(_token_index(token) for token in tokenize(text))
+    length = sum(counts.values())
+    k1, b = settings.BM25_K1, settings.BM25_B
+    norm = k1 * (1 - b + b * length / settings.BM25_AVG_DOC_TOKENS)
+    return _to_sparse({index: tf * (k1 + 1) / (tf + norm) for index, tf in counts.items()})
+
+
+def query_sparse_vector(query: str) -> models.SparseVector:
+    """
+    クエリの疎ベクトル (出現したトークンに重み1)
+    """
+    return _to_sparse({_token_index(token): 1.0 for token in tokenize(query)})
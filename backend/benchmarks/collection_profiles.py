@@ -0,0 +1,135 @@
+"""
+コレクションプロファイルごとの再現率とレイテンシのベンチマーク
+
+各プロファイル (default / scalar / binary / large) でコレクションを作り、同じランダムベクトルを投入する。
+全件比較 (exact=True) の結果を正解として、近似検索の recall@k と p50 / p99 レイテンシを測る。
+量子化や on_disk は Qdrant サーバーでのみ有効なため、実際の Qdrant に対して実行すること。
+
+使い方 (backend ディレクトリで実行):
+    python -m benchmarks.collection_profiles --url http://localhost:6333 --points 100000 --hnsw-ef 64 128
+    (--url :memory: で動作確認だけを行える。ただし量子化などの設定は反映されない)
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+os.environ.setdefault("QDRANT_HOST", "http://localhost:6333")
+os.environ["HYBRID_SEARCH_ENABLED"] = "false"
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(np.array(values), q))
+
+
+def _make_vectors(rng: np.random.Generator, count: int, dimension: int, centers: np.ndarray) -> np.ndarray:
+    # 実際の埋め込みに近づけるため、クラスタ中心の周りに分布させてから正規化する
+    vectors = centers[rng.integers(0, len(centers), size=count)] + rng.standard_normal((count, dimension)) * 0.5
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+async def run(args) -> list[dict]:
+    from qdrant_client import models
+    from app.db.vector_store import COLLECTION_PROFILES, build_search_params, get_qdrant_client, init_collection
+
+    client = get_qdrant_client()
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((64, args.dimension))
+    queries = _make_vectors(rng, args.queries, args.dimension, centers)
+    results = []
+
+    for name in args.profiles:
+        profile = COLLECTION_PROFILES[name]
+        collection = f"bench_profile_{name}"
+        if await client.collection_exists(collection):
+            await client.delete_collection(collection)
+
+        await init_collection(collection, vector_size=args.dimension, profile=name)
+
+        # ベクトル投入 (毎回同じ乱数列を使い、プロファイル間で同じデータにする)
+        data_rng = np.random.default_rng(7)
+        started = time.perf_counter()
+        for offset in range(0, args.points, args.batch_size):
+            count = min(args.batch_size, args.points - offset)
+            vectors = _make_vectors(data_rng, count, args.dimension, centers)
+            await client.upsert(
+                collection_name=collection,
+                points=models.Batch(ids=list(range(offset, offset + count)), vectors=vectors.tolist()),
+                wait=offset + count >= args.points,
+            )
+        # インデックス構築の完了を待つ
+        while (await client.get_collection(collection)).status != models.CollectionStatus.GREEN:
+            await asyncio.sleep(1)
+        ingest_seconds = time.perf_counter() - started
+
+        async def search(query: np.ndarray, params: models.SearchParams) -> tuple[set, float]:
+            begin = time.perf_counter()
+            response = await client.query_points(
+                collection_name=collection, query=query.tolist(), limit=args.k, search_params=params
+            )
+            return {p.id for p in response.points}, time.perf_counter() - begin
+
+        # 正解は量子化ベクトルを使わず、元のベクトルで全件比較した結果にする
+        # (量子化を無視しないと、正解自体が量子化の影響を受けて再現率が高く出てしまう)
+        truth_params = models.SearchParams(
+            exact=True,
+            quantization=models.QuantizationSearchParams(ignore=True, rescore=False)
+        )
+        truth = [
+            (await search(q, truth_params))[0]
+            for q in queries
+        ]
+
+        for hnsw_ef in args.hnsw_ef:
+            params = build_search_params(profile, hnsw_ef=hnsw_ef, exact=False)
+            latencies = []
+            hits = 0
+            for q, expected in zip(queries, truth):
+                found, latency = await search(q, params)
+                latencies.append(latency)
+                hits += len(found & expected)
+            results.append({
+                "profile": name,
+                "hnsw_ef": hnsw_ef,
+                "points": args.points,
+                "dimension": args.dimension,
+                "recall_at_k": hits / (len(queries) * args.k),
+                "p50_ms": _percentile(latencies, 50) * 1000,
+                "p99_ms": _percentile(latencies, 99) * 1000,
+                "ingest_seconds": ingest_seconds,
+            })
+            print(json.dumps(results[-1]))
+
+        if not args.keep:
+            await client.delete_collection(collection)
+
+    await client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ["QDRANT_HOST"])
+    parser.add_argument("--profiles", nargs="+", default=["default", "scalar", "binary", "large"])
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--hnsw-ef", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--keep", action="store_true", help="ベンチマーク用コレクションを削除しない")
+    args = parser.parse_args()
+    os.environ["QDRANT_HOST"] = args.url
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
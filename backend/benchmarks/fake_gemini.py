@@ -0,0 +1,106 @@
+"""
+ベンチマーク用の Gemini (生成・エージェント) の決定的なダミー
+
+genai.GenerativeModel を差し替え、ネットワークに接続せずに
+generate_content (通常・ストリーミング) と start_chat().send_message_async を応答させる。
+応答までの時間は latency (最初のチャンクまで) と chunk_latency (以降のチャンクごと) で指定する。
+
+エージェントのチャットは、最初のターンでユーザーの入力をそのまま retrieve_knowledge の
+function_call として返し、ツールの結果を受け取った次のターンでテキストの回答を返す。
+(1回の質問 = Gemini 2往復 + 検索1回 という、実際の典型的なターンを再現する)
+埋め込みは EMBEDDING_BACKEND=fake (FakeEmbeddingBackend) を使う。
+"""
+import asyncio
+import time
+
+import google.generativeai as genai
+from google.generativeai import protos
+from google.generativeai.types import generation_types
+
+ANSWER_CHUNKS = ("ドキュメントによると、", "ご質問の内容は", "資料に記載されています。")
+
+
+def _response(part: protos.Part) -> protos.GenerateContentResponse:
+    return protos.GenerateContentResponse(
+        candidates=[protos.Candidate(content=protos.Content(role="model", parts=[part]), index=0)]
+    )
+
+
+class FakeStream:
+    """
+    send_message_async(stream=True) の戻り値の代わり。
+    async for でチャンクを返し、読み終えた後は candidates で全体をまとめて参照できる。
+    """
+
+    def __init__(self, chunks: list[protos.GenerateContentResponse], latency: float, chunk_latency: float):
+        self.chunks = chunks
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+
+    async def __aiter__(self):
+        for i, chunk in enumerate(self.chunks):
+            await asyncio.sleep(self.latency if i == 0 else self.chunk_latency)
+            yield chunk
+
+    @property
+    def candidates(self) -> list[protos.Candidate]:
+        parts = [part for chunk in self.chunks for part in chunk.candidates[0].content.parts]
+        return [protos.Candidate(content=protos.Content(role="model", parts=parts), index=0)]
+
+
+class FakeChat:
+    def __init__(self, model: "FakeGenerativeModel"):
+        self.model = model
+
+    async def send_message_async(self, message, stream: bool = False) -> FakeStream:
+        FakeGenerativeModel.calls += 1
+        if isinstance(message, str):
+            # 最初のターン: 検索ツールを呼ぶ
+            part = protos.Part(function_call=protos.FunctionCall(name="retrieve_knowledge", args={"query": message}))
+            chunks = [_response(part)]
+        else:
+            # ツールの結果を受け取ったターン: 回答をストリーミングで返す
+            chunks = [_response(protos.Part(text=text)) for text in ANSWER_CHUNKS]
+        return FakeStream(chunks, self.model.latency, self.model.chunk_latency)
+
+
+class FakeGenerativeModel:
+    """
+    genai.GenerativeModel の代わり (install() で差し替える)
+    """
+    latency = 0.0
+    chunk_latency = 0.0
+    calls = 0
+
+    def __init__(self, model_name: str = "", tools=None, **kwargs):
+        self.model_name = model_name
+
+    def start_chat(self, **kwargs) -> FakeChat:
+        return FakeChat(self)
+
+    def generate_content(self, prompt, stream: bool = False):
+        # 呼び出し元 (generation.py) はスレッドで実行するため、同期的に待つ
+        FakeGenerativeModel.calls += 1
+        if not stream:
+            time.sleep(self.latency + self.chunk_latency * (len(ANSWER_CHUNKS) - 1))
+            # .text で本文を参照できるよう、SDK の応答型で包む
+            return generation_types.GenerateContentResponse.from_response(
+                _response(protos.Part(text="".join(ANSWER_CHUNKS)))
+            )
+        return self._stream()
+
+    def _stream(self):
+        for i, text in enumerate(ANSWER_CHUNKS):
+            time.sleep(self.latency if i == 0 else self.chunk_latency)
+            yield _response(protos.Part(text=text))
+
+
+def install(latency: float = 0.0, chunk_latency: float = 0.0):
+    """
+    genai.GenerativeModel をダミーに差し替える。
+    アプリのモデル (get_generation_model / get_agent_model) を最初に作る前に呼ぶこと。
+    """
+    FakeGenerativeModel.latency = latency
+    FakeGenerativeModel.chunk_latency = chunk_latency
+    FakeGenerativeModel.calls = 0
+    genai.GenerativeModel = FakeGenerativeModel
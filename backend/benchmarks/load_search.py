@@ -0,0 +1,83 @@
+"""
+/api/search の並行負荷テスト
+
+埋め込みAPIがイベントループをブロックしていないことを確認する。
+fake バックエンドに擬似レイテンシを設定し、N件の検索を同時に投げたときに
+合計時間が「N × レイテンシ」(直列実行) ではなく「≒ 1 × レイテンシ」になることを検証する。
+
+使い方 (backend ディレクトリで実行):
+    python -m benchmarks.load_search --requests 16 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# アプリの設定を読み込む前に、ネットワーク不要の構成にする
+os.environ.setdefault("QDRANT_HOST", ":memory:")
+os.environ.setdefault("EMBEDDING_BACKEND", "fake")
+
+
+async def run(num_requests: int, latency: float) -> bool:
+    os.environ["EMBEDDING_FAKE_LATENCY"] = str(latency)
+    os.environ.setdefault("EMBEDDING_EXECUTOR_WORKERS", str(num_requests))
+    os.environ.setdefault("EMBEDDING_MAX_CONCURRENCY", str(num_requests))
+
+    import httpx
+    from app.main import app
+    from app.db.vector_store import init_collection
+    from app.services.embeddings import get_embedding_engine
+    from app.services.ingestion import process_and_save_document, COLLECTION_NAME
+
+    await init_collection(COLLECTION_NAME, vector_size=get_embedding_engine().dimension)
+    await process_and_save_document("sample.pdf", "DocuBrain の負荷テスト用ドキュメントです。" * 50)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def search(i: int) -> float:
+            start = time.perf_counter()
+            response = await client.post("/api/search", json={"query": f"query {i}", "limit": 3})
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        async def health() -> float:
+            # 検索の負荷中でも /health が即座に応答するか
+            await asyncio.sleep(latency / 4)
+            start = time.perf_counter()
+            response = await client.get("/health")
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        *latencies, health_latency = await asyncio.gather(
+            *(search(i) for i in range(num_requests)), health()
+        )
+        wall = time.perf_counter() - start
+
+    serial = num_requests * latency
+    print(f"requests        : {num_requests}")
+    print(f"fake latency    : {latency:.3f}s")
+    print(f"wall time       : {wall:.3f}s (serial would be >= {serial:.3f}s)")
+    print(f"max request     : {max(latencies):.3f}s")
+    print(f"/health latency : {health_latency:.3f}s")
+
+    # 直列実行の半分未満で終われば、リクエストは重なって処理されている
+    overlapped = wall < serial / 2
+    responsive = health_latency < latency
+    print("RESULT          :", "PASS" if overlapped and responsive else "FAIL")
+    return overlapped and responsive
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.requests, args.latency))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
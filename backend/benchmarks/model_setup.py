@@ -0,0 +1,74 @@
+"""
+Gemini モデルの準備にかかるリクエストごとのオーバーヘッドの計測
+
+以前は1リクエストごとに GenerativeModel を作り直し、エージェントでは AGENT_TOOLS の
+関数シグネチャとdocstringからツールの宣言を毎回組み立てていた。
+共有モデル (get_agent_model / get_generation_model) を使う現在の方式と比べて、
+1リクエストあたりの準備時間 (Geminiへの送信前までにかかる時間) を計測する。
+ネットワークには接続しない。
+
+使い方 (backend ディレクトリで実行):
+    python -m benchmarks.model_setup --iterations 2000
+"""
+import argparse
+import json
+import os
+import time
+
+# アプリの設定を読み込む前に、ネットワーク不要の構成にする
+os.environ.setdefault("QDRANT_HOST", ":memory:")
+os.environ.setdefault("EMBEDDING_BACKEND", "fake")
+
+
+def _measure(setup, iterations: int) -> float:
+    """
+    setup を iterations 回実行し、1回あたりの平均時間 (マイクロ秒) を返す
+    """
+    setup()  # 初回のみの遅延初期化を除外する
+    started = time.perf_counter()
+    for _ in range(iterations):
+        setup()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def run(iterations: int) -> dict:
+    import google.generativeai as genai
+    from app.services.agent_tools import AGENT_TOOLS
+    from app.services.agent_runner import AGENT_MODEL_NAME, get_agent_model
+    from app.services.generation import MODEL_NAME, get_generation_model
+
+    def agent_per_request():
+        genai.GenerativeModel(model_name=AGENT_MODEL_NAME, tools=AGENT_TOOLS).start_chat(
+            enable_automatic_function_calling=False
+        )
+
+    def agent_shared():
+        get_agent_model().start_chat(enable_automatic_function_calling=False)
+
+    results = {
+        "iterations": iterations,
+        "agent_per_request_us": _measure(agent_per_request, iterations),
+        "agent_shared_us": _measure(agent_shared, iterations),
+        "generation_per_request_us": _measure(lambda: genai.GenerativeModel(MODEL_NAME), iterations),
+        "generation_shared_us": _measure(get_generation_model, iterations),
+    }
+    results["agent_speedup"] = results["agent_per_request_us"] / results["agent_shared_us"]
+    results["generation_speedup"] = results["generation_per_request_us"] / results["generation_shared_us"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
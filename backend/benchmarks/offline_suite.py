@@ -0,0 +1,282 @@
+"""
+ネットワーク不要のベンチマークスイート (取り込み・検索・エージェント)
+
+埋め込みは fake バックエンド (決定的なダミーベクトル)、Gemini は benchmarks.fake_gemini のダミー、
+Qdrant はプロセス内の :memory: を使う。それぞれの擬似レイテンシを指定できるため、
+split_text / process_and_save_document / search_relevant_documents などの変更が
+スループットとレイテンシに与える影響を、外部サービスなしで比較できる。
+
+計測するもの:
+    - ingestion: 合成ドキュメントを並行して取り込んだときの docs/sec・chunks/sec
+    - search: 並行検索の QPS と p50 / p99 レイテンシ
+    - agent: エージェントの1ターン (Gemini 2往復 + 検索) の並行実行時の p50 / p99 レイテンシ
+各セクションには、tracing で記録された段階ごとの合計時間も含める。
+
+使い方 (backend ディレクトリで実行):
+    python -m benchmarks.offline_suite --output results.json
+    python -m benchmarks.offline_suite --embedding-latency 0.05 --llm-latency 0.3 --concurrency 16
+    # 以前の結果と比べ、許容範囲を超えて悪化した指標があれば終了コード 1 を返す
+    python -m benchmarks.offline_suite --baseline results.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# アプリの設定を読み込む前に、ネットワーク不要の構成にする
+os.environ.setdefault("QDRANT_HOST", ":memory:")
+os.environ.setdefault("EMBEDDING_BACKEND", "fake")
+os.environ.setdefault("RERANK_ENABLED", "false")
+# 同じ質問を繰り返しても計測がキャッシュで歪まないよう、既定では結果キャッシュを切る
+os.environ.setdefault("SEARCH_CACHE_SIZE", "0")
+os.environ.setdefault("ANSWER_CACHE_SIZE", "0")
+
+WORDS = (
+    "Python", "FastAPI", "Qdrant", "React", "TypeScript", "Docker", "Kubernetes", "AWS",
+    "機械学習", "データ分析", "プロジェクト管理", "チームリーダー", "設計", "開発", "運用", "改善",
+    "経験", "担当", "構築", "導入", "顧客", "要件定義", "テスト", "自動化", "検索", "推薦",
+)
+
+# 悪化の判定に使う指標 (True: 大きいほど良い / False: 小さいほど良い)
+TRACKED_METRICS = {
+    "docs_per_sec": True,
+    "chunks_per_sec": True,
+    "qps": True,
+    "p50_ms": False,
+    "p99_ms": False,
+}
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(np.array(values), q))
+
+
+def _latency_stats(latencies: list[float]) -> dict:
+    return {
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "mean_ms": float(np.mean(latencies)) * 1000,
+        "max_ms": float(np.max(latencies)) * 1000,
+    }
+
+
+def make_document(rng: np.random.Generator, paragraphs: int) -> str:
+    """
+    決定的な合成ドキュメント (語をランダムに並べた段落の集まり)
+    """
+    lines = []
+    for _ in range(paragraphs):
+        words = rng.choice(WORDS, size=int(rng.integers(40, 120)))
+        lines.append("、".join(words) + "。")
+    return "\n\n".join(lines)
+
+
+async def _run_concurrently(task, count: int, concurrency: int) -> tuple[list[float], float]:
+    """
+    task(i) を count 回、同時実行数 concurrency で実行し、(各回のレイテンシ, 全体の経過時間) を返す
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(i: int) -> float:
+        async with semaphore:
+            started = time.perf_counter()
+            await task(i)
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(i) for i in range(count)))
+    return list(latencies), time.perf_counter() - started
+
+
+def _stage_totals(trace) -> dict[str, float]:
+    return {stage: seconds * 1000 for stage, seconds in sorted(trace.summary().items())}
+
+
+async def bench_ingestion(args, documents: list[str]) -> dict:
+    from app.core.tracing import start_trace
+    from app.services.ingestion import process_and_save_document
+
+    chunk_counts = []
+
+    async def ingest(i: int):
+        chunk_counts.append(await process_and_save_document(f"bench_{i:05d}.pdf", documents[i]))
+
+    trace = start_trace()
+    latencies, wall = await _run_concurrently(ingest, len(documents), args.ingest_concurrency)
+    chunks = sum(chunk_counts)
+    return {
+        "documents": len(documents),
+        "chunks": chunks,
+        "concurrency": args.ingest_concurrency,
+        "wall_seconds": wall,
+        "docs_per_sec": len(documents) / wall,
+        "chunks_per_sec": chunks / wall,
+        **_latency_stats(latencies),
+        "stages_ms": _stage_totals(trace),
+    }
+
+
+async def bench_search(args, queries: list[str]) -> dict:
+    from app.core.tracing import start_trace
+    from app.services.search import search_relevant_documents
+
+    async def search(i: int):
+        await search_relevant_documents(queries[i % len(queries)], limit=args.limit)
+
+    # 初回のみの初期化 (モデルの読み込みなど) を計測から除く
+    await search(0)
+    trace = start_trace()
+    latencies, wall = await _run_concurrently(search, args.searches, args.concurrency)
+    return {
+        "requests": args.searches,
+        "concurrency": args.concurrency,
+        "wall_seconds": wall,
+        "qps": args.searches / wall,
+        **_latency_stats(latencies),
+        "stages_ms": _stage_totals(trace),
+    }
+
+
+async def bench_agent(args, queries: list[str]) -> dict:
+    from app.core.tracing import start_trace
+    from app.services.agent_runner import run_agent_chat
+    from benchmarks.fake_gemini import FakeGenerativeModel
+
+    async def turn(i: int):
+        await run_agent_chat(queries[i % len(queries)])
+
+    await turn(0)
+    calls_before = FakeGenerativeModel.calls
+    trace = start_trace()
+    latencies, wall = await _run_concurrently(turn, args.agent_turns, args.concurrency)
+    return {
+        "turns": args.agent_turns,
+        "concurrency": args.concurrency,
+        "wall_seconds": wall,
+        "qps": args.agent_turns / wall,
+        "gemini_calls": FakeGenerativeModel.calls - calls_before,
+        **_latency_stats(latencies),
+        "stages_ms": _stage_totals(trace),
+    }
+
+
+async def run(args) -> dict:
+    # 設定はアプリを import する前に環境変数で渡す
+    os.environ["EMBEDDING_FAKE_LATENCY"] = str(args.embedding_latency)
+
+    from benchmarks import fake_gemini
+
+    fake_gemini.install(latency=args.llm_latency, chunk_latency=args.llm_chunk_latency)
+
+    from app.core.config import settings
+    from app.db.vector_store import init_collection
+    from app.services.embeddings import close_embedding_engine, get_embedding_engine
+    from app.services.extractor import shutdown_extraction_executor
+    from app.services.ingestion import COLLECTION_NAME
+
+    await init_collection(COLLECTION_NAME, vector_size=get_embedding_engine().dimension)
+
+    rng = np.random.default_rng(args.seed)
+    documents = [make_document(rng, args.paragraphs) for _ in range(args.documents)]
+    queries = [" ".join(rng.choice(WORDS, size=3)) + "の経験は？" for _ in range(256)]
+
+    results = {
+        "benchmark": "offline_suite",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "seed": args.seed,
+            "embedding_latency": args.embedding_latency,
+            "llm_latency": args.llm_latency,
+            "llm_chunk_latency": args.llm_chunk_latency,
+            "embedding_batch_size": settings.EMBEDDING_BATCH_SIZE,
+            "embedding_max_concurrency": settings.EMBEDDING_MAX_CONCURRENCY,
+            "chunk_max_tokens": settings.CHUNK_MAX_TOKENS,
+            "hybrid_search": settings.HYBRID_SEARCH_ENABLED,
+            "search_cache_size": settings.SEARCH_CACHE_SIZE,
+            "answer_cache_size": settings.ANSWER_CACHE_SIZE,
+        },
+    }
+    try:
+        if "ingestion" in args.only:
+            results["ingestion"] = await bench_ingestion(args, documents)
+        else:
+            # 検索の対象がないと計測にならないため、取り込みを計測せずに投入だけしておく
+            await bench_ingestion(args, documents)
+        if "search" in args.only:
+            results["search"] = await bench_search(args, queries)
+        if "agent" in args.only:
+            results["agent"] = await bench_agent(args, queries)
+    finally:
+        close_embedding_engine()
+        shutdown_extraction_executor()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    baseline と比べて tolerance (割合) を超えて悪化した指標を返す
+    """
+    regressions = []
+    for section in ("ingestion", "search", "agent"):
+        current, previous = results.get(section), baseline.get(section)
+        if not current or not previous:
+            continue
+        for metric, higher_is_better in TRACKED_METRICS.items():
+            if metric not in current or not previous.get(metric):
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            worse = -change if higher_is_better else change
+            if worse > tolerance:
+                regressions.append(
+                    f"{section}.{metric}: {previous[metric]:.2f} -> {current[metric]:.2f} ({change:+.1%})"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", default=["ingestion", "search", "agent"],
+                        choices=["ingestion", "search", "agent"], help="実行するセクション")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--documents", type=int, default=50, help="取り込むドキュメント数")
+    parser.add_argument("--paragraphs", type=int, default=20, help="1ドキュメントあたりの段落数")
+    parser.add_argument("--ingest-concurrency", type=int, default=4)
+    parser.add_argument("--searches", type=int, default=500, help="検索の総リクエスト数")
+    parser.add_argument("--agent-turns", type=int, default=100, help="エージェントの総ターン数")
+    parser.add_argument("--concurrency", type=int, default=8, help="検索・エージェントの同時実行数")
+    parser.add_argument("--limit", type=int, default=5, help="検索で取得する件数")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="埋め込み1バッチの擬似レイテンシ (秒)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Geminiの最初のチャンクまでの擬似レイテンシ (秒)")
+    parser.add_argument("--llm-chunk-latency", type=float, default=0.01, help="Geminiの以降のチャンクごとの擬似レイテンシ (秒)")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較対象の以前の結果 (JSON)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="悪化とみなす変化の割合")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        results["regressions"] = regressions
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if regressions:
+        print("RESULT: REGRESSION", *regressions, sep="\n  ", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()